@@ -21,7 +21,7 @@ app = Flask(__name__)
 @app.route("/")
 def status():
     """Handles the webapp root."""
-    info = get_serverinfo("localhost", 5001)
+    info = get_serverinfo("localhost", 5002)
 
     MAXUPDATES = 4 # that's all the current template can handle
 
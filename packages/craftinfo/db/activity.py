@@ -0,0 +1,335 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Rolls up the activity of a server into minutes and hours.
+
+The ActivityRecorder is added to the LogEvents of a LogParser, like the
+SessionRecorder. It counts the players online, the uptime of the server
+and the logins of each minute, writing a row for each minute in batches.
+Hours are rolled up from the minutes once they are complete, and the
+minutes older than a few days are deleted, so graphs over longer ranges
+are read from the hours.
+
+Minutes and hours without any activity have no rows. Like the events of
+the SessionRecorder, minutes and hours that can't be written stay queued.
+
+Archived logs are recorded by a separate ActivityRecorder for the history,
+which skips the minutes and hours recorded already instead of the events
+before the newest minute.
+
+"""
+
+import traceback
+from time import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from craftinfo.db.tables import MinuteActivity, HourActivity
+
+MINUTE = timedelta(minutes=1)
+HOUR = timedelta(hours=1)
+
+def get_activity(session, start, end, server=None, hourly=False):
+    """Returns the rows of the minutes or hours starting within the range,
+    oldest first.
+
+    arguments:
+    session -- sqlalchemy session
+    start -- datetime the range starts at
+    end -- datetime the range ends before
+    server -- name of the server the activity was recorded for
+    hourly -- True to return hours instead of minutes
+
+    """
+    table = HourActivity if hourly else MinuteActivity
+    return session.query(table).filter(
+        table.server == server, table.start >= start, table.start < end
+    ).order_by(table.start).all()
+
+class ActivityRecorder(object):
+    """Counts the activity of a server within each minute.
+
+    Each event advances the current minute to its date, closing the
+    minutes before. Stretches in which the server is stopped and nobody
+    is online are skipped at once. Events dated before the current minute
+    still change who is online and whether the server is running, but
+    aren't counted, as their minute was closed already. That's the case
+    if the log is read again, lags behind the ticks, or the clock is set
+    back. As no event tells that a minute passed without any, tick should
+    be called periodically.
+
+    While paused is set, the minutes are only written by flush, like the
+    events of a paused SessionRecorder.
+
+    The server counts as running from a start until a stop event, logins
+    don't tell that it is, as the log may lack the start.
+
+    """
+
+    def __init__(self, session, batchsize=100, delay=1.0, server=None,
+                 online=(), keep=timedelta(days=2), grace=10,
+                 history=False):
+        """Continues after the newest minute found in the database.
+
+        arguments:
+        session -- sqlalchemy session used exclusively by the recorder
+        batchsize -- number of minutes written at once
+        delay -- seconds a minute may wait to be written
+        server -- name of the server the activity is recorded for
+        online -- names of the players online
+        keep -- timedelta for which the minutes are kept
+        grace -- seconds the log may lag behind the clock
+        history -- True to record the events of archived logs
+
+        """
+        self.session = session
+        self.server = server
+        self.batchsize = batchsize
+        self.delay = delay
+        self.keep = keep
+        self.grace = grace
+        self.history = history
+        self.paused = False
+
+        self._queue = []
+        self._queued = None
+        self._hours = set()
+        self._failed = False
+
+        self._online = set(online)
+        self._running = False
+
+        # the starts of the minutes and hours recorded already
+        self._recorded = set()
+
+        if history:
+            newest = None
+            for table in (MinuteActivity, HourActivity):
+                self._recorded.update(start for start, in session.query(
+                    table.start
+                ).filter(table.server == server))
+        else:
+            newest = session.query(func.max(MinuteActivity.start)).filter(
+                MinuteActivity.server == server
+            ).scalar()
+
+        # the minute that is counted, and the time counted up to
+        self._start = newest + MINUTE if newest else None
+        self._time = self._start
+        self._reset()
+
+    def on_playerlogin(self, player, date):
+        counted = self._advance(date)
+        self._online.add(player)
+        if counted:
+            self._logins += 1
+            self._players_max = max(self._players_max, len(self._online))
+
+    def on_playerlogout(self, player, date):
+        self._advance(date)
+        self._online.discard(player)
+
+    def on_serverstart(self, version, date):
+        """Resets the players, as no player is online after a start."""
+        self._advance(date)
+        self._online.clear()
+        self._running = True
+
+    def on_serverstop(self, date):
+        """Resets the players, as the server disconnects them."""
+        self._advance(date)
+        self._online.clear()
+        self._running = False
+
+    def set_running(self, running, date=None):
+        """Sets whether the server is running from the date on, now if no
+        date is given.
+
+        """
+        self._advance(date or datetime.now())
+        self._running = running
+
+    def tick(self, now=None):
+        """Closes the minutes that passed, allowing for the log to lag
+        behind by the grace seconds.
+
+        """
+        now = now or datetime.now()
+        self._advance(now - timedelta(seconds=self.grace))
+
+    def finish(self):
+        """Closes the current minute and hour and writes them, at the end
+        of the archived logs.
+
+        """
+        if self._start is not None:
+            hour = _floor(self._start, 'hour')
+            self._close()
+            if hour not in self._recorded:
+                self._hours.add(hour)
+
+            self._start = self._time = None
+            self._reset()
+
+        self.flush()
+
+    def flush_if_due(self):
+        """Writes the closed minutes if the oldest waited long enough, or
+        if an hour is complete. After a failed write, both wait for the
+        delay.
+
+        """
+        if self.paused:
+            return
+
+        waited = self._queued and time() - self._queued >= self.delay
+        if waited or self._hours and not self._failed:
+            self.flush()
+
+    def flush(self):
+        """Writes the closed minutes and rolls up the completed hours in
+        one transaction.
+
+        If the transaction fails, the minutes and hours are queued again.
+
+        """
+        if not self._queue and not self._hours:
+            return
+
+        queue, self._queue, self._queued = self._queue, [], None
+        hours, self._hours = sorted(self._hours), set()
+
+        try:
+            self.session.add_all(queue)
+            self.session.flush()
+
+            for hour in hours:
+                self._roll_up(hour)
+
+            if hours:
+                self.session.query(MinuteActivity).filter(
+                    MinuteActivity.server == self.server,
+                    MinuteActivity.start < hours[-1] + HOUR - self.keep
+                ).delete(synchronize_session=False)
+
+            self.session.commit()
+        except:
+            self.session.rollback()
+            self._queue[:0] = queue
+            self._hours.update(hours)
+            self._queued = time()
+            self._failed = True
+            raise
+
+        self._failed = False
+
+    def _reset(self):
+        self._players_max = len(self._online)
+        self._player_seconds = 0.0
+        self._uptime = 0.0
+        self._logins = 0
+
+    def _advance(self, date):
+        """Counts the activity up to the date, returns False if the date
+        is before the current minute, which is left alone then.
+
+        """
+        if self._start is None:
+            self._start = _floor(date)
+            self._time = self._start
+        elif date < self._start:
+            return False
+
+        # events dated before the counted time, but within the minute,
+        # are counted as if they happened now
+        date = max(date, self._time)
+
+        while date >= self._start + MINUTE:
+            hour = _floor(self._start, 'hour')
+            end = self._start + MINUTE
+            self._count(end)
+            self._close()
+
+            # skip the minutes without activity
+            if self._online or self._running:
+                self._start = end
+            else:
+                self._start = _floor(date)
+
+            if _floor(self._start, 'hour') != hour:
+                if hour not in self._recorded:
+                    self._hours.add(hour)
+
+            self._time = self._start
+            self._reset()
+
+        self._count(date)
+        return True
+
+    def _count(self, date):
+        seconds = (date - self._time).total_seconds()
+        self._player_seconds += len(self._online) * seconds
+        if self._running:
+            self._uptime += seconds
+        self._time = date
+
+    def _close(self):
+        """Queues the row of the current minute, if there was activity."""
+        # late logins aren't counted, but the players are online now
+        self._players_max = max(self._players_max, len(self._online))
+        if not (self._players_max or self._uptime or self._logins):
+            return
+
+        hour = _floor(self._start, 'hour')
+        if self._start in self._recorded or hour in self._recorded:
+            return
+
+        self._queue.append(MinuteActivity(
+            self.server, self._start, self._players_max,
+            int(round(self._player_seconds)), int(round(self._uptime)),
+            self._logins
+        ))
+        if self._queued is None:
+            self._queued = time()
+
+        full = len(self._queue) >= self.batchsize
+        if full and not self._failed and not self.paused:
+            # called by the LogParser, which has to read on if writing fails
+            try:
+                self.flush()
+            except Exception:
+                traceback.print_exc()
+
+    def _roll_up(self, hour):
+        """Writes the row of the hour, summing up its minutes."""
+        players_max, player_seconds, uptime, logins = self.session.query(
+            func.max(MinuteActivity.players_max),
+            func.sum(MinuteActivity.player_seconds),
+            func.sum(MinuteActivity.uptime),
+            func.sum(MinuteActivity.logins),
+        ).filter(
+            MinuteActivity.server == self.server,
+            MinuteActivity.start >= hour, MinuteActivity.start < hour + HOUR
+        ).one()
+
+        if players_max is None:
+            return
+
+        row = self.session.query(HourActivity).filter(
+            HourActivity.server == self.server, HourActivity.start == hour
+        ).first()
+        if row is None:
+            row = HourActivity(self.server, hour, 0, 0, 0, 0)
+            self.session.add(row)
+
+        row.players_max = players_max
+        row.player_seconds = player_seconds
+        row.uptime = uptime
+        row.logins = logins
+
+def _floor(date, unit='minute'):
+    """Returns the start of the minute or hour of the date."""
+    if unit == 'hour':
+        return date.replace(minute=0, second=0, microsecond=0)
+    return date.replace(second=0, microsecond=0)
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Reads and writes the messages shown to the clients.
+
+Each change of the messages increases their revision, which is a single
+row read by primary key. Readers compare it to the revision of the
+messages they have, instead of querying the messages on every update.
+
+"""
+
+from datetime import datetime
+
+from sqlalchemy import desc
+
+from craftinfo.db.tables import Message, Revision
+
+# Name of the revision of the messages
+REVISION = 'messages'
+
+def get_messages(session, limit=None):
+    """Returns the newest messages first, at most limit if given."""
+    query = session.query(Message).order_by(desc(Message.date))
+    if limit is not None:
+        query = query.limit(limit)
+
+    return query.all()
+
+def get_revision(session, name=REVISION):
+    """Returns the number of changes of the messages, 0 if none."""
+    revision = session.query(Revision.revision).filter(
+        Revision.name == name
+    ).scalar()
+
+    return revision or 0
+
+def add_message(session, text, date=None):
+    """Adds a message, dated now if no date is given."""
+    session.add(Message(date or datetime.now(), text))
+    _increase_revision(session)
+    session.commit()
+
+def delete_message(session, uid):
+    """Deletes the message by id, returns False if there is none."""
+    deleted = session.query(Message).filter(Message.uid == uid).delete()
+    if deleted:
+        _increase_revision(session)
+    session.commit()
+
+    return bool(deleted)
+
+def _increase_revision(session, name=REVISION):
+    """Increases the revision within the transaction of the change."""
+    updated = session.query(Revision).filter(Revision.name == name).update(
+        {Revision.revision: Revision.revision + 1}, synchronize_session=False
+    )
+    if not updated:
+        session.add(Revision(name, 1))
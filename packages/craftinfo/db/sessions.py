@@ -0,0 +1,190 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Records the sessions of the players in the database.
+
+The SessionRecorder is added to the LogEvents of a LogParser. As a commit
+for each event would stall the server, events are queued and written in
+batches, each within a single transaction. If a batch can't be written,
+for example as the database is locked, its events stay queued and are
+written with the next batch.
+
+Archived logs are recorded by a separate SessionRecorder for the history,
+which skips the sessions recorded already instead of the events older
+than the last one recorded.
+
+"""
+
+import traceback
+from time import time
+
+from sqlalchemy import func
+
+from craftinfo.db.tables import Session
+
+class SessionRecorder(object):
+    """Writes a Session row for each login, completed on logout.
+
+    The queued events are written once the number of events reaches the
+    batchsize or the oldest event waited for longer than the delay. As
+    the latter is only checked on new events, flush_if_due should be
+    called periodically. After a failed write, the events are only
+    written again once the delay passed.
+
+    While paused is set, the events are only written by flush, so another
+    recorder can write to the database meanwhile.
+
+    """
+
+    def __init__(self, session, batchsize=100, delay=1.0, server=None,
+                 history=False):
+        """Continues the sessions found in the database.
+
+        arguments:
+        session -- sqlalchemy session used exclusively by the recorder
+        batchsize -- number of events written at once
+        delay -- seconds an event may wait to be written
+        server -- name of the server the sessions are recorded for
+        history -- True to record the events of archived logs, leaving
+                   the open sessions alone
+
+        """
+        self.session = session
+        self.server = server
+        self.batchsize = batchsize
+        self.delay = delay
+        self.history = history
+        self.paused = False
+
+        self._queue = []
+        self._queued = None
+        self._failed = False
+
+        if history:
+            self._open = dict()
+            self._latest = None
+            return
+
+        query = session.query(Session).filter(Session.server == server)
+        self._open = dict(
+            (s.player, s) for s in query.filter(Session.logout == None)
+        )
+
+        # events before the last recorded one were recorded already, the
+        # log being read from the start again
+        logins, logouts = session.query(
+            func.max(Session.login), func.max(Session.logout)
+        ).filter(Session.server == server).one()
+        self._latest = max(logins, logouts) if logouts else logins
+
+    def on_playerlogin(self, player, date):
+        self._enqueue('login', player, date)
+
+    def on_playerlogout(self, player, date):
+        self._enqueue('logout', player, date)
+
+    def on_serverstart(self, version, date):
+        self._enqueue('start', version, date)
+
+    def on_serverstop(self, date):
+        self._enqueue('stop', None, date)
+
+    def get_open(self):
+        """Returns the names of the players with an open session."""
+        return self._open.keys()
+
+    def flush_if_due(self):
+        """Writes the queued events if the oldest waited long enough."""
+        if self.paused:
+            return
+
+        if self._queue and time() - self._queued >= self.delay:
+            self.flush()
+
+    def flush(self):
+        """Writes the queued events in one transaction.
+
+        If the transaction fails, the events are queued again and the
+        open sessions are the ones before.
+
+        """
+        if not self._queue:
+            return
+
+        queue, self._queue, self._queued = self._queue, [], None
+        opened = dict(self._open)
+
+        try:
+            for kind, name, date in queue:
+                getattr(self, '_' + kind)(name, date)
+            self.session.commit()
+        except:
+            # the rollback expires the changes of the sessions kept open
+            self.session.rollback()
+            self._open = opened
+            self._queue[:0] = queue
+            self._queued = time()
+            self._failed = True
+            raise
+
+        self._failed = False
+
+    def _enqueue(self, kind, name, date):
+        if self._latest and date < self._latest:
+            return
+
+        self._queue.append((kind, name, date))
+        if self._queued is None:
+            self._queued = time()
+
+        # called by the LogParser, which has to read on if writing fails
+        try:
+            full = len(self._queue) >= self.batchsize
+            if full and not self._failed and not self.paused:
+                self.flush()
+            else:
+                self.flush_if_due()
+        except Exception:
+            traceback.print_exc()
+
+    def _login(self, player, date):
+        previous = self._open.get(player)
+        if previous:
+            # recorded before the log was read again
+            if previous.login == date:
+                return
+
+            previous.logout = date
+            previous.interrupted = True
+
+        if self.history and self._is_recorded(player, date):
+            # its logout was recorded along with it
+            self._open.pop(player, None)
+            return
+
+        self._open[player] = Session(player, date, self.server)
+        self.session.add(self._open[player])
+
+    def _is_recorded(self, player, login):
+        """Returns True if the session of the login is in the database."""
+        query = self.session.query(Session.uid).filter(
+            Session.server == self.server, Session.player == player,
+            Session.login == login
+        )
+        return query.first() is not None
+
+    def _logout(self, player, date):
+        session = self._open.pop(player, None)
+        if session:
+            session.logout = date
+
+    def _start(self, version, date):
+        """Closes all sessions, as no player is online after a start."""
+        self._stop(None, date)
+
+    def _stop(self, name, date):
+        """Closes all sessions, as the players are disconnected."""
+        for session in self._open.values():
+            session.logout = date
+            session.interrupted = True
+        self._open.clear()
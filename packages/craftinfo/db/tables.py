@@ -1,8 +1,8 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-from sqlalchemy import Column
-from sqlalchemy import Integer, String, DateTime
+from sqlalchemy import Column, inspect
+from sqlalchemy import Boolean, Integer, String, DateTime
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -10,7 +10,7 @@ Base = declarative_base()
 class Message(Base):
     __tablename__ = 'messages'
     uid = Column(Integer, primary_key=True)
-    date = Column(DateTime, nullable=False)
+    date = Column(DateTime, nullable=False, index=True)
     text = Column(String(255), nullable=False)
 
     def __init__(self, date, text):
@@ -32,5 +32,101 @@ class Version(Base):
     def __repr__(self):
         return "<Version(%s - %s)>" % (self.uid, self.date)
 
+class Revision(Base):
+    """Counts the changes of a table, telling readers whether to query
+    it again.
+
+    """
+    __tablename__ = 'revisions'
+    name = Column(String(100), primary_key=True)
+    revision = Column(Integer, nullable=False)
+
+    def __init__(self, name, revision):
+        self.name = name
+        self.revision = revision
+
+    def __repr__(self):
+        return "<Revision(%s - %s)>" % (self.name, self.revision)
+
+class Session(Base):
+    __tablename__ = 'sessions'
+    uid = Column(Integer, primary_key=True)
+    server = Column(String(100), index=True)
+    player = Column(String(100), nullable=False, index=True)
+    login = Column(DateTime, nullable=False)
+    logout = Column(DateTime)
+
+    # True if the session ended without the player logging out
+    interrupted = Column(Boolean, nullable=False, default=False)
+
+    def __init__(self, player, login, server=None):
+        self.server = server
+        self.player = player
+        self.login = login
+        self.interrupted = False
+
+    def __repr__(self):
+        return "<Session(%s - %s - %s - %s)>" % (
+            self.uid, self.player, self.login, self.logout
+        )
+
+class _Activity(object):
+    """Columns of the activity of a server within a period, the length of
+    which in seconds is given by the seconds of the table.
+
+    """
+    uid = Column(Integer, primary_key=True)
+    server = Column(String(100))
+    start = Column(DateTime, nullable=False, index=True)
+
+    # most players online at the same time
+    players_max = Column(Integer, nullable=False)
+
+    # seconds the players were online, summed up over all players
+    player_seconds = Column(Integer, nullable=False)
+
+    # seconds the server was running
+    uptime = Column(Integer, nullable=False)
+    logins = Column(Integer, nullable=False)
+
+    def __init__(self, server, start, players_max, player_seconds, uptime,
+                 logins):
+        self.server = server
+        self.start = start
+        self.players_max = players_max
+        self.player_seconds = player_seconds
+        self.uptime = uptime
+        self.logins = logins
+
+    @property
+    def players_avg(self):
+        """Returns the average number of players online."""
+        return self.player_seconds / float(self.seconds)
+
+    def __repr__(self):
+        return "<%s(%s - %s - %s - %s)>" % (
+            self.__class__.__name__, self.server, self.start,
+            self.players_max, self.logins
+        )
+
+class MinuteActivity(_Activity, Base):
+    __tablename__ = 'activity_minutes'
+    seconds = 60
+
+class HourActivity(_Activity, Base):
+    __tablename__ = 'activity_hours'
+    seconds = 3600
+
 def create_tables(engine):
-    Base.metadata.create_all(engine)
\ No newline at end of file
+    """Creates the missing tables, and the indexes missing on tables
+    created before the indexes were added.
+
+    """
+    Base.metadata.create_all(engine)
+
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = set(i['name'] for i in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
\ No newline at end of file
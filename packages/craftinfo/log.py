@@ -1,9 +1,29 @@
 from __future__ import with_statement
 
+import io
 import os
 import re
+import glob
+import gzip
+import json
+import hashlib
+import multiprocessing
 from datetime import datetime
-from time import strptime
+from time import time
+
+DATEFORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Number of dates remembered by parse_date
+DATECACHE_SIZE = 256
+
+# Number of bytes at the beginning of the logfile used to identify it
+HEADSIZE = 1024
+
+# Number of bytes read at once by the LogFollower
+CHUNKSIZE = 1024 * 1024
+
+# Logfiles smaller than this are not worth to be read by multiple processes
+BACKFILL_MINSIZE = 16 * 1024 * 1024
 
 class LogEvents(object):
     """Provides a list with events triggered by the LogParser.
@@ -16,6 +36,7 @@ class LogEvents(object):
         'on_playerlogin',
         'on_playerlogout',
         'on_serverstart',
+        'on_serverstop',
         )
 
     # TODO get rid of duplicated code by changing the __init__ function 
@@ -25,42 +46,293 @@ class LogEvents(object):
         self.on_playerlogin = lambda player, date: None
         self.on_playerlogout = lambda player, date: None
         self.on_serverstart = lambda version, date: None
+        self.on_serverstop = lambda date: None
+
+    def add(self, listener):
+        """Adds the methods of the listener named like the events.
+
+        The methods are called after the functions already set, allowing
+        multiple listeners to be notified by one LogParser.
+
+        """
+        for name in self.__slots__:
+            method = getattr(listener, name, None)
+            if method:
+                setattr(self, name, _chain(getattr(self, name), method))
+
+def _chain(first, second):
+    """Returns a function calling both functions with the same arguments."""
+    def chained(*args):
+        first(*args)
+        second(*args)
+    return chained
+
+# Patterns of the events the LogParser reacts to. Named groups have to be
+# unique among all patterns as they are compiled into a single expression.
+PATTERNS = (
+    ('login', r"\[INFO\]\s(?P<login_player>[a-zA-Z0-9_]*)\s.*logged in"),
+    ('logout', r"\[INFO\]\s(?P<logout_player>[a-zA-Z0-9_]*)\s.*lost connection"),
+    ('start', r"Starting(?:.*?server version (?P<version>\S*))?"),
+    ('stop', r"Stopping server"),
+)
+
+class LineClassifier(object):
+    """Tags log-lines with the kind of event they stand for.
+
+    All registered patterns are compiled into one regular expression, so
+    each line is scanned once, no matter how many kinds of events are
+    known. Lines containing a '<' are always tagged as 'chat', as players
+    could otherwise trigger events by chatting.
+
+    """
+    def __init__(self, patterns=PATTERNS):
+        self._patterns = []
+        self._regex = None
+
+        for kind, pattern in patterns:
+            self.register(kind, pattern)
+
+    def register(self, kind, pattern):
+        """Adds a new kind of event identified by the given pattern.
+
+        The leftmost match on a line wins. If patterns match at the same
+        position of a line, the one registered first wins.
+
+        """
+        if kind == 'chat' or kind in self.kinds():
+            raise ValueError("kind '%s' is already registered" % kind)
+
+        self._patterns.append((kind, pattern))
+        self._regex = None
+
+    def kinds(self):
+        return [kind for kind, pattern in self._patterns]
+
+    def patterns(self):
+        return list(self._patterns)
+
+    def classify(self, line):
+        """Returns a tuple with the kind of the line and the match object.
+
+        Chatlines are returned as ('chat', None). If the line doesn't match
+        any pattern (None, None) is returned.
+
+        """
+        if '<' in line:
+            return 'chat', None
+
+        regex = self._regex or self._compile()
+
+        m = regex.search(line)
+        if m is None:
+            return None, None
+        else:
+            return m.lastgroup, m
+
+    def _compile(self):
+        """Compiles the registered patterns into a single expression.
+
+        Each alternative is followed by an empty group named after its kind.
+        Being the last group closed, it is reported as lastgroup of the match.
+        Leaving the start of the patterns untouched allows the regex engine
+        to skip ahead to possible matches.
+
+        """
+        alternatives = [
+            "%s(?P<%s>)" % (pattern, kind) for kind, pattern in self._patterns
+        ]
+        self._regex = re.compile("|".join(alternatives) or "(?!)")
+        return self._regex
 
 class LogParser(object):
     """Reads the Minecraft server log incrementally, keeping a playerlist
     and the last start time of the server.
 
+    The number of lines read by update and the seconds it took in total
+    are counted in lines and update_time. players_version is increased
+    whenever the playerlist changes.
+
     """
-    def __init__(self, path, logevents=LogEvents()):
-        """Reads the logfile given by argument."""
+    def __init__(self, path, logevents=LogEvents(), checkpoint=None,
+                 checkpoint_interval=60, processes=1):
+        """Reads the logfile given by argument.
+
+        arguments:
+        path -- path to the Minecraft server log
+        logevents -- LogEvents instance notified about events
+        checkpoint -- path of a file to save the position and state to,
+                      allowing to resume instead of reading from the start
+        checkpoint_interval -- seconds between checkpoints during updates
+        processes -- number of processes reading the logfile if it has
+                     to be read from the start (see backfill)
+
+        """
         self.path = path
-        self.follow = None
+        self.follower = None
         self.events = logevents
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self._lastcheckpoint = time()
+        self.lines = 0
+        self.update_time = 0.0
+        self.players_version = 0
+        self.classifier = LineClassifier()
+        self._handlers = {
+            'login': self._handle_login,
+            'logout': self._handle_logout,
+            'start': self._handle_start,
+            'stop': self._handle_stop,
+        }
         self.reset()
+        if not self.restore_checkpoint() and processes > 1:
+            self.backfill(processes)
         self.update()
-        
+
     def __del__(self):
         """Ensures that the file-handle is released upon deletion."""
         print "del"
         self._stopfollowing()
 
     def _stopfollowing(self):
-        """Signals the follower generator to stop and close the file."""
-        if self.follow:
-            self.follow.close()
+        """Signals the follower to close the file."""
+        if self.follower:
+            self.follower.close()
 
-    def reset(self):
+    def reset(self, offset=0):
         """Resets the class. Lines are deleted and reading starts from
-        the beginning of the file again.
+        the beginning of the file again, or from the given offset.
 
         """
         self._players = dict()
-        self._startime = datetime
-        self._version = None
+        self.players_version += 1
+        self._starttime = None
+        self.version = None
         
         self._stopfollowing()
 
-        self.follower = _follow(self.path)
+        self.follower = LogFollower(self.path, offset)
+
+    def save_checkpoint(self):
+        """Writes the position in the logfile and the current state to
+        the checkpoint file.
+
+        The file is replaced atomically, so a crash while saving leaves
+        the previous checkpoint intact.
+
+        """
+        if not self.checkpoint or not os.path.isfile(self.path):
+            return
+
+        starttime = self._starttime and self._starttime.strftime(DATEFORMAT)
+
+        state = dict(
+            identity=get_identity(self.path),
+            offset=self.follower.offset,
+            players=dict(
+                (player, date.strftime(DATEFORMAT))
+                for player, date in self._players.items()
+            ),
+            starttime=starttime,
+            version=self.version,
+        )
+
+        temp = self.checkpoint + '.tmp'
+        with open(temp, 'wb') as f:
+            json.dump(state, f)
+
+        if os.name == 'nt' and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        os.rename(temp, self.checkpoint)
+
+        self._lastcheckpoint = time()
+
+    def restore_checkpoint(self):
+        """Restores the state saved by save_checkpoint and continues to
+        read from the saved offset.
+
+        The checkpoint is ignored if the logfile changed in the meantime,
+        i.e. if it was replaced, truncated or if its head differs.
+        Returns True if the checkpoint was restored.
+
+        """
+        if not self.checkpoint or not os.path.isfile(self.checkpoint):
+            return False
+
+        try:
+            with open(self.checkpoint, 'rb') as f:
+                state = json.load(f)
+        except ValueError:
+            return False
+
+        if not os.path.isfile(self.path):
+            return False
+
+        offset = state['offset']
+        saved = state['identity']
+        current = get_identity(self.path, saved['headsize'])
+
+        if current['inode'] != saved['inode']:
+            return False
+        if current['size'] < offset or current['head'] != saved['head']:
+            return False
+
+        self.reset(offset)
+
+        for player, date in state['players'].items():
+            self._players[player] = parse_date(date)
+
+        if state['starttime']:
+            self._starttime = parse_date(state['starttime'])
+        self.version = state['version']
+
+        return True
+
+    def backfill(self, processes=None):
+        """Reads the logfile from the start using a pool of processes.
+
+        The file is split into ranges of complete lines, which are
+        classified by the processes. The lines of the events are then
+        handled in order, resulting in the same state and events as a
+        call to reset followed by update.
+
+        arguments:
+        processes -- number of processes, defaults to the number of cpus
+
+        """
+        processes = processes or multiprocessing.cpu_count()
+
+        self.reset()
+
+        if not os.path.isfile(self.path):
+            return
+
+        end = _get_complete_size(self.path)
+        if processes < 2 or end < BACKFILL_MINSIZE:
+            self.update()
+            return
+
+        patterns = self.classifier.patterns()
+        ranges = _get_ranges(self.path, end, processes * 4)
+        tasks = [(self.path, start, stop, patterns) for start, stop in ranges]
+
+        classify = self.classifier.classify
+        handlers = self._handlers
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            for events in pool.imap(_classify_range, tasks):
+                for kind, line in events:
+                    if kind in handlers:
+                        handlers[kind](line, classify(line)[1])
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        self._stopfollowing()
+        self.follower = LogFollower(self.path, end)
 
     def update(self):
         """Reads through the logfile in increments and stores 
@@ -71,48 +343,80 @@ class LogParser(object):
         before the lines are reloaded.
 
         """
-        if not os.path.exists(self.path):
-            return
+        starttime = time()
+        self.lines += self._handle(self.follower.batches())
+        self.update_time += time() - starttime
 
-        for line in self.follower:
-            # If the line is None the follower is done, for now.
-            # So don't be clever and change this into a list comprehension
-            # as it will result in an endless loop
-            if not line:
-                break
+        if self.checkpoint:
+            if time() - self._lastcheckpoint >= self.checkpoint_interval:
+                self.save_checkpoint()
+
+    def _handle(self, batches):
+        """Classifies the lines in the batches and calls their handlers.
+
+        Returns the number of lines handled.
+
+        """
+        classify = self.classifier.classify
+        handlers = self._handlers
+        count = 0
+
+        for lines in batches:
+            count += len(lines)
+            for line in lines:
+                # Chatlines are tagged as such and have no handler
+                kind, match = classify(line)
+                if kind in handlers:
+                    handlers[kind](line, match)
+
+        return count
 
-            # Chatlines might contain stuff that triggers commands later
-            if self._is_chatline(line):
-                continue
-            
-            # If a player joins, add him to the list.
-            player = self._get_playerlogin(line)
-            if player:
-                login = self._get_date(line)
-                self._players[player] = login
-
-                self.events.on_playerlogin(player, login)
-                continue
-
-            # If a player leaves, remove him from the list.
-            player = self._get_playerlogout(line)
-            if player and player in self._players:    
-                logout = self._get_date(line)
-                del self._players[player]
-
-                self.events.on_playerlogout(player, logout)
-                continue
-
-            # Update the starttime (the last is always the latests).
-            if 'Starting' in line:
-                self._starttime = self._get_date(line)
-                self.version = self._get_serverversion(line)
-
-                # clear the playerlist as there cannot be any connected
-                # player on startup
-                self._players.clear()
-                self.events.on_serverstart(self.version, self._starttime)
-                continue
+    def register(self, kind, pattern, handler):
+        """Registers a new kind of event.
+
+        The handler is called with the line and the match object for each
+        line matching the pattern. As lines are only read once, reset has
+        to be called for the handler to see lines read before.
+
+        """
+        self.classifier.register(kind, pattern)
+        self._handlers[kind] = handler
+
+    def _handle_login(self, line, match):
+        """If a player joins, add him to the list."""
+        player = match.group('login_player')
+        login = self._get_date(line)
+        self._players[player] = login
+        self.players_version += 1
+
+        self.events.on_playerlogin(player, login)
+
+    def _handle_logout(self, line, match):
+        """If a player leaves, remove him from the list."""
+        player = match.group('logout_player')
+        if player in self._players:
+            logout = self._get_date(line)
+            del self._players[player]
+            self.players_version += 1
+
+            self.events.on_playerlogout(player, logout)
+
+    def _handle_start(self, line, match):
+        """Update the starttime (the last is always the latests)."""
+        self._starttime = self._get_date(line)
+        self.version = match.group('version')
+
+        # clear the playerlist as there cannot be any connected
+        # player on startup
+        self._players.clear()
+        self.players_version += 1
+        self.events.on_serverstart(self.version, self._starttime)
+
+    def _handle_stop(self, line, match):
+        """Clear the playerlist, as the server disconnects all players."""
+        self._players.clear()
+        self.players_version += 1
+        self.events.on_serverstop(self._get_date(line))
 
     def get_playerlist(self):
         return self._players.keys()
@@ -122,58 +426,314 @@ class LogParser(object):
 
     def _get_date(self, line):
         """Returns the date from a given log-line"""
-        return strptime(line[:19], "%Y-%m-%d %H:%M:%S")
+        return parse_date(line[:19])
 
-    def _get_playerlogin(self, line):
-        """Returns the playername if the player joined on the given line.
 
-        Otherwise None is returned
+_dates = dict()
 
-        """
-        m = re.search("\[INFO\]\s([a-zA-Z0-9_]*)\s.*logged in", line)
-        if m == None:
-            return None
-        else:
-            return m.groups(0)[0]
-    
-    def _get_playerlogout(self, line):
-        """Returns the playername if the player left on the given line.
+def parse_date(text):
+    """Returns the datetime of a string formatted as 'YYYY-MM-DD HH:MM:SS'.
 
-        Otherwise None is returned
+    The fields are sliced directly, which is a lot faster than strptime.
+    As events tend to happen in bursts, the recently parsed dates are
+    cached by their text.
 
-        """
-        m = re.search("\[INFO\]\s([a-zA-Z0-9_]*)\s.*lost connection", line)
+    """
+    try:
+        return _dates[text]
+    except KeyError:
+        pass
 
-        if m == None:
-            return None
-        else:
-            return m.groups(0)[0]   
+    date = datetime(
+        int(text[0:4]), int(text[5:7]), int(text[8:10]),
+        int(text[11:13]), int(text[14:16]), int(text[17:19])
+    )
 
-    def _get_serverversion(self, line):
-        """ Returns the serverversion or None. """
-        m = re.search("server version (\S*)", line)
-        if m == None:
-            return None
-        else:
-            return m.groups(0)[0]
+    if len(_dates) >= DATECACHE_SIZE:
+        _dates.clear()
+    _dates[text] = date
+
+    return date
+
+
+def get_archive(pattern, exclude=()):
+    """Returns the logfiles matching the glob pattern ordered by date.
+
+    If the pattern is a directory, the files ending in '.log' or '.log.gz'
+    within it are returned. The files are ordered by the date of their
+    first line, files without a date by name before all others.
+
+    """
+    if os.path.isdir(pattern):
+        paths = glob.glob(os.path.join(pattern, '*.log'))
+        paths += glob.glob(os.path.join(pattern, '*.log.gz'))
+    else:
+        paths = glob.glob(pattern)
+
+    exclude = [os.path.abspath(path) for path in exclude if path]
+    paths = [
+        path for path in paths
+        if os.path.isfile(path) and os.path.abspath(path) not in exclude
+    ]
 
-    def _is_chatline(self, line):
-        return '<' in line
+    return sorted(paths, key=lambda path: (_get_first_date(path), path))
 
 
-def _follow(logfile):
-    """ Yields the lines of the givenfile indefinitely.
+def ingest(pattern, logevents, exclude=()):
+    """Reads archived logfiles, notifying the given LogEvents.
 
-    If the yield is None the function read until the end. However,
-    if new lines are appended, those will again be yielded. Being a
-    generator this function keeps the file open until the close method
-    is called on the generator.
+    The files are the ones returned by get_archive, read in the order of
+    their first date. Files ending in '.gz' are decompressed on the fly.
+    As the files are read in chunks, memory use doesn't depend on the
+    size of the archive.
+
+    The lines are handled by a LogParser of their own, so the parsers of
+    the live logfiles and their LogEvents don't see events older than
+    the ones of their logfile.
+
+    Returns the list of archived files read.
 
     """
+    history = LogParser(os.devnull, logevents)
+
+    paths = get_archive(pattern, exclude)
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, "rb") as f:
+            blocks = _read_blocks(f.read)
+            history._handle(block.splitlines(True) for block in blocks)
+
+    return paths
+
+
+def _get_first_date(path):
+    """Returns the date of the first line of the file or None."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, "rb") as f:
+        line = f.readline()
+
     try:
-        assert(os.path.exists(logfile) and os.path.isfile(logfile))
-        with open(logfile, "rb") as f:
-            while True:
-                yield f.readline()
-    except GeneratorExit:
-        pass
\ No newline at end of file
+        return parse_date(line[:19])
+    except ValueError:
+        return None
+
+
+def _read_blocks(read, chunksize=CHUNKSIZE, limit=None, partial=''):
+    """Yields the data returned by read in blocks of complete lines.
+
+    Reading stops at the end of the data, or after limit bytes if given.
+    The partial line is put in front of the data read. The rest after the
+    last newline is yielded last, being the only block not ending in a
+    newline.
+
+    """
+    while limit is None or limit > 0:
+        chunk = read(chunksize if limit is None else min(chunksize, limit))
+        if not chunk:
+            break
+        if limit is not None:
+            limit -= len(chunk)
+
+        data = partial + chunk
+        end = data.rfind('\n') + 1
+        partial = data[end:]
+
+        if end:
+            yield data[:end]
+
+    if partial:
+        yield partial
+
+
+def _get_complete_size(path):
+    """Returns the size of the file up to the end of the last line."""
+    with open(path, "rb") as f:
+        end = os.fstat(f.fileno()).st_size
+
+        while end > 0:
+            start = max(0, end - CHUNKSIZE)
+            f.seek(start)
+            newline = f.read(end - start).rfind('\n')
+            if newline != -1:
+                return start + newline + 1
+            end = start
+
+    return 0
+
+
+def _get_ranges(path, end, count):
+    """Splits the file up to end into count ranges of complete lines.
+
+    Returns a list of (start, stop) tuples.
+
+    """
+    bounds = [0]
+    with open(path, "rb") as f:
+        for i in range(1, count):
+            f.seek(end * i // count)
+            f.readline()
+            bounds.append(min(f.tell(), end))
+    bounds.append(end)
+
+    return [
+        (start, stop) for start, stop in zip(bounds, bounds[1:]) if start < stop
+    ]
+
+
+def _classify_range(task):
+    """Classifies the lines in a range of the file.
+
+    Runs in the processes of LogParser.backfill. Returns a list with
+    (kind, line) tuples of all lines which are neither chat nor unknown.
+
+    """
+    path, start, stop, patterns = task
+    classify = LineClassifier(patterns).classify
+
+    events = []
+    with open(path, "rb") as f:
+        f.seek(start)
+
+        for block in _read_blocks(f.read, limit=stop - start):
+            for line in block.splitlines(True):
+                kind = classify(line)[0]
+                if kind and kind != 'chat':
+                    events.append((kind, line))
+
+    return events
+
+
+def get_identity(path, headsize=HEADSIZE):
+    """Returns a dictionary identifying the given file.
+
+    Besides inode and size, the hash of the first bytes of the file is
+    included, as inodes are reused and not available on every platform.
+
+    """
+    with open(path, "rb") as f:
+        head = f.read(headsize)
+        size = os.fstat(f.fileno()).st_size
+        inode = os.fstat(f.fileno()).st_ino
+
+    return dict(
+        inode=inode,
+        size=size,
+        headsize=len(head),
+        head=hashlib.sha1(head).hexdigest(),
+    )
+
+
+class LogFollower(object):
+    """Yields the lines appended to a file, keeping track of the offset.
+
+    Iterating stops at the end of the file. If new lines are appended,
+    iterating again will yield them. The file stays open until the close
+    method is called.
+
+    The file is read in chunks, which are split into batches of lines.
+    A line which is not terminated yet is kept back until the rest of it
+    is read. The offset always points to the end of the last line yielded.
+
+    Whenever the end of the file is reached, the follower checks if the
+    file was rotated (replaced by a new file) or truncated. Rotated files
+    are read to the end before continuing with the new file from the
+    start. Truncated files are read from the start again.
+
+    """
+    def __init__(self, logfile, offset=0, chunksize=CHUNKSIZE):
+        self.logfile = logfile
+        self.offset = offset
+        self.chunksize = chunksize
+        self._file = None
+        self._partial = ''
+
+    def __iter__(self):
+        for lines in self.batches():
+            for line in lines:
+                yield line
+
+    def batches(self):
+        """Yields lists of lines up to the end of the file."""
+        if not self._file and not self._open():
+            return
+
+        while True:
+            for lines in self._drain():
+                yield lines
+
+            change = self._get_change()
+
+            if change == 'rotated':
+                # lines might have been written before the rotation
+                for lines in self._drain():
+                    yield lines
+
+                # the rotated file won't be completed anymore
+                if self._partial:
+                    self.offset += len(self._partial)
+                    yield [self._partial]
+
+                self.close()
+                self.offset = 0
+                if not self._open():
+                    break
+            elif change == 'truncated':
+                self._file.seek(0)
+                self.offset = 0
+                self._partial = ''
+            else:
+                break
+
+    def close(self):
+        """Releases the file handle."""
+        if self._file:
+            self._file.close()
+            self._file = None
+            self._partial = ''
+
+    def _open(self):
+        """Opens the logfile at the current offset, if it exists."""
+        if not os.path.isfile(self.logfile):
+            return False
+
+        # unbuffered, as buffered files don't see data appended after
+        # the end of the file was reached once
+        self._file = io.open(self.logfile, "rb", buffering=0)
+        self._file.seek(self.offset)
+        return True
+
+    def _drain(self):
+        """Yields the lines up to the end of the open file in batches."""
+        blocks = _read_blocks(self._file.read, self.chunksize,
+                              partial=self._partial)
+
+        for block in blocks:
+            if not block.endswith('\n'):
+                # kept back until the rest of the line is written
+                self._partial = block
+                break
+
+            self._partial = ''
+            self.offset += len(block)
+            yield block.splitlines(True)
+
+    def _get_change(self):
+        """Returns 'rotated' if the path points to a different file than
+        the one open, 'truncated' if the file shrunk below the offset or
+        None if neither happened.
+
+        A missing path is not considered a change, as the new file might
+        not have been created yet.
+
+        """
+        try:
+            stat = os.stat(self.logfile)
+        except OSError:
+            return None
+
+        if stat.st_ino != os.fstat(self._file.fileno()).st_ino:
+            return 'rotated'
+        if stat.st_size < self.offset:
+            return 'truncated'
+
+        return None
@@ -6,12 +6,21 @@
 Detects the OS-type to use the appropriate method. Note that the results
 are OS-dependent e.g. giving you more information in a Unix environment.
 
+On systems with procfs, single processes can be checked by their PID
+without reading the whole process list.
+
 """
 
+from __future__ import with_statement
+
 import os
 from ctypes import *
 from subprocess import Popen, PIPE
 
+if hasattr(os, 'sysconf'):
+    CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
 def get_proclist():
     """Return a list of running processes depending on the OS."""
     if os.name == "nt":
@@ -30,19 +39,95 @@ def get_proclist_posix():
     procfs = os.path.isdir('/proc')
 
     if procfs:
-        pids= [pid for pid in os.listdir('/proc') if pid.isdigit()]
-        
-        procs = []
-        for pid in pids:
-            procs.append(open(os.path.join('/proc', pid, 'cmdline'), 'rb').read())
-
-        return procs
+        return [cmdline for pid, cmdline in get_procs_posix()]
     else:
         # some unixes like osx are not using procfs, use ps aux in this case
         proc = Popen('ps aux', stdout=PIPE, stderr=PIPE, shell=True)
         stdout, stderr = proc.communicate()
-        return stdout.split('os.linesep')
-        
+        return stdout.splitlines()
+
+def get_procs_posix():
+    """Return a list of (pid, command line) tuples of the running processes
+    read from /proc, empty if there is no /proc folder.
+
+    Processes ending while the list is read are left out.
+
+    """
+    if not os.path.isdir('/proc'):
+        return []
+
+    procs = []
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+
+        cmdline = get_cmdline(int(pid))
+        if cmdline is not None:
+            procs.append((int(pid), cmdline))
+
+    return procs
+
+def get_cmdline(pid):
+    """Return the command line of the process, its arguments separated by
+    null bytes, or None if there is no such process.
+
+    """
+    try:
+        with open('/proc/%i/cmdline' % pid, 'rb') as f:
+            return f.read()
+    except IOError:
+        return None
+
+def get_starttime(pid):
+    """Return the start time of the process in clock ticks since boot, or
+    None if there is no such process.
+
+    Together with the pid, the start time identifies a process, as pids
+    are reused.
+
+    """
+    fields = _read_stat(pid)
+    if fields is None:
+        return None
+
+    return int(fields[22 - 3])
+
+def get_resources(pid):
+    """Return a tuple of the cpu time in seconds (user and system), the
+    resident memory in bytes, the number of threads and the start time of
+    the process, or None if there is no such process.
+
+    All of it is read from /proc/<pid>/stat at once.
+
+    """
+    fields = _read_stat(pid)
+    if fields is None:
+        return None
+
+    cputime = (int(fields[14 - 3]) + int(fields[15 - 3])) / float(CLOCK_TICKS)
+    rss = int(fields[24 - 3]) * PAGE_SIZE
+    return cputime, rss, int(fields[20 - 3]), int(fields[22 - 3])
+
+def _read_stat(pid):
+    """Return the fields of /proc/<pid>/stat from field 3 on, or None."""
+    try:
+        with open('/proc/%i/stat' % pid, 'rb') as f:
+            stat = f.read()
+    except IOError:
+        return None
+
+    # the name of the command may contain spaces and parentheses, the
+    # fields after it start behind the last parenthesis with field 3
+    return stat[stat.rindex(')') + 2:].split()
+
+def read_pidfile(path):
+    """Return the pid written to the file, or None if there is none."""
+    try:
+        with open(path, 'rb') as f:
+            return int(f.read().strip())
+    except (IOError, ValueError):
+        return None
+
 
 def get_proclist_win():
     """
@@ -11,26 +11,281 @@ is fully supported.
 from __future__ import with_statement
 
 import os
-from craftinfo.proc import get_proclist
+from time import time
+from array import array
+from craftinfo.proc import get_proclist, get_procs_posix, get_starttime
+from craftinfo.proc import get_resources, read_pidfile, get_cmdline
 
-def is_running():
+# Strings identifying the command line of a Minecraft server
+DEFAULT_MATCH = ('minecraft_server', 'bukkit')
+
+def is_running(match=DEFAULT_MATCH, procs=None):
     """Returns True if the Server is running.
 
     The used jar file for the server must contain 'minecraft_server'
-    for the code to work.
+    for the code to work. To tell multiple servers apart, other strings
+    found in the command line of the server can be given as match.
 
     Windows is currently not supported as it doesn't yield enough
     information about running processes to use the same concept as
     used on Unix.
+
+    arguments:
+    match -- strings of which one has to be found in the command line
+    procs -- process list to search, read from the system if None
     
     """
     if os.name == "nt":
         return False
 
-    for proc in get_proclist():
-        if proc.find("minecraft_server") != -1:
-            return True
-        elif proc.find("bukkit") != -1:
-            return True
+    if procs is None:
+        procs = get_proclist()
+
+    for proc in procs:
+        for text in match:
+            if proc.find(text) != -1:
+                return True
+
+    return False
+
+class ProcessScan(object):
+    """Shares one scan of the process list between multiple servers.
+
+    The process list is read at most once within maxage seconds, so
+    servers checked at the same tick don't scan the processes again.
+
+    The number of scans and the seconds they took in total are counted
+    in scans and scan_time.
+
+    """
+
+    def __init__(self, maxage=1):
+        self.maxage = maxage
+        self.scans = 0
+        self.scan_time = 0.0
+        self._procs = None
+        self._scanned = 0
+        self._pids = None
+        self._pids_scanned = 0
+
+    def get_proclist(self):
+        if self._procs is None or time() - self._scanned >= self.maxage:
+            starttime = time()
+            self._procs = get_proclist()
+            self._scanned = time()
+
+            self.scans += 1
+            self.scan_time += self._scanned - starttime
+
+        return self._procs
+
+    def get_procs(self):
+        """Returns (pid, command line) tuples, see proc.get_procs_posix."""
+        if self._pids is None or time() - self._pids_scanned >= self.maxage:
+            starttime = time()
+            self._pids = get_procs_posix()
+            self._pids_scanned = time()
+
+            self.scans += 1
+            self.scan_time += self._pids_scanned - starttime
+
+        return self._pids
+
+    def is_running(self, match=DEFAULT_MATCH):
+        """Returns True if a server with the given match is running."""
+        if os.name == "nt":
+            return False
+
+        return is_running(match, self.get_proclist())
+
+class ProcessWatcher(object):
+    """Tracks the process of one server by its pid.
+
+    The process list is only scanned until the process is found, or read
+    from the pidfile if one is given. The pid read from the pidfile is
+    only taken if the command line of its process matches, as the pid of
+    a stale pidfile might have been reused by another process.
+    Afterwards, it is only checked that /proc/<pid> still exists with the
+    same start time, so a reused pid isn't mistaken for the server. Once
+    the process is gone, the list is scanned again, at most once within
+    the interval.
+
+    Without /proc, the process list is scanned each time.
+
+    """
+
+    def __init__(self, match=DEFAULT_MATCH, pidfile=None, scan=None,
+                 interval=1):
+        """Takes what identifies the process of the server.
+
+        arguments:
+        match -- strings of which one is found in the command line of the
+                 server process, as for is_running
+        pidfile -- file the server writes its pid to, instead of scanning
+        scan -- ProcessScan to share the scans with other watchers
+        interval -- minimal seconds between scans while not running
+
+        """
+        self.match = match
+        self.pidfile = pidfile
+        self.interval = interval
+        self.pid = None
+        self.starttime = None
+        self._scan = scan or ProcessScan(maxage=0)
+        self._searched = None
+
+    def is_running(self):
+        """Returns True if the server is running."""
+        if os.name == "nt":
+            return False
+
+        if not os.path.isdir('/proc'):
+            return is_running(self.match, self._scan.get_proclist())
+
+        if self.pid is not None:
+            if get_starttime(self.pid) == self.starttime:
+                return True
+            self.pid = None
+
+        if self._searched is None or time() - self._searched >= self.interval:
+            self._searched = time()
+            self.pid = self._find()
+            if self.pid is not None:
+                self.starttime = get_starttime(self.pid)
+                if self.starttime is None:
+                    self.pid = None
+
+        return self.pid is not None
+
+    def get_pid(self):
+        """Returns the pid of the server, None if it isn't running."""
+        if self.is_running():
+            return self.pid
+        return None
+
+    def _find(self):
+        """Returns the pid of the server process or None."""
+        if self.pidfile:
+            pid = read_pidfile(self.pidfile)
+            if pid is not None and self._matches(get_cmdline(pid)):
+                return pid
+            return None
+
+        for pid, cmdline in self._scan.get_procs():
+            if self._matches(cmdline):
+                return pid
+
+        return None
+
+    def _matches(self, cmdline):
+        """Returns True if the command line is the one of the server."""
+        if cmdline is None:
+            return False
+
+        for text in self.match:
+            if cmdline.find(text) != -1:
+                return True
+
+        return False
+
+class ResourceSampler(object):
+    """Samples the cpu time, memory and threads of the server process.
+
+    Each sample only reads /proc/<pid>/stat of the process the
+    ProcessWatcher found last, so sampling is cheap enough to be done
+    every second. The sampler never searches the process, while it is
+    gone the watcher finds it again when checked whether it is running.
+    The samples are kept in arrays used as ring buffer, holding the last
+    size samples. The history is cleared once the process changes.
+
+    """
+
+    def __init__(self, watcher, size=300):
+        """Takes the ProcessWatcher and the number of samples kept."""
+        self.watcher = watcher
+        self.size = size
+        self.count = 0
+        self._next = 0
+        self._starttime = None
+        self._times = array('d', [0.0]) * size
+        self._cputimes = array('d', [0.0]) * size
+        self._rss = array('d', [0.0]) * size
+        self._threads = array('l', [0]) * size
+
+    def sample(self):
+        """Takes a sample, returns False if the server isn't running."""
+        pid = self.watcher.pid
+        resources = pid and get_resources(pid)
+
+        # the pid might have been reused since the watcher checked it
+        if not resources or resources[3] != self.watcher.starttime:
+            self.clear()
+            return False
+
+        cputime, rss, threads, starttime = resources
+        if starttime != self._starttime:
+            self.clear()
+            self._starttime = starttime
+
+        i = self._next
+        self._times[i] = time()
+        self._cputimes[i] = cputime
+        self._rss[i] = rss
+        self._threads[i] = threads
+
+        self._next = (i + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+        return True
+
+    def clear(self):
+        """Removes all samples."""
+        self.count = 0
+        self._next = 0
+        self._starttime = None
+
+    def get_samples(self, window=None):
+        """Returns the samples of the last window seconds, or all, as
+        tuples of the time, the cpu time, the resident memory and the
+        number of threads, oldest first.
+
+        """
+        since = time() - window if window is not None else None
+
+        samples = []
+        for n in range(self.count, 0, -1):
+            i = (self._next - n) % self.size
+            if since is not None and self._times[i] < since:
+                continue
+
+            samples.append((
+                self._times[i], self._cputimes[i], int(self._rss[i]),
+                self._threads[i]
+            ))
+
+        return samples
+
+    def get_aggregates(self, window=60):
+        """Returns a dictionary of the resources used in the last window
+        seconds, None if there are no samples:
+
+        cpu -- cpu usage in percent of one core
+        rss -- current resident memory in bytes
+        rss_max -- maximal resident memory in bytes
+        threads -- current number of threads
+
+        """
+        samples = self.get_samples(window)
+        if not samples:
+            return None
+
+        first, last = samples[0], samples[-1]
+        elapsed = last[0] - first[0]
+        if elapsed > 0:
+            cpu = (last[1] - first[1]) / elapsed * 100
+        else:
+            cpu = 0.0
 
-    return False
\ No newline at end of file
+        return dict(
+            cpu=round(cpu, 1), rss=last[2],
+            rss_max=max(sample[2] for sample in samples), threads=last[3]
+        )
@@ -1,3 +1,8 @@
 from craftinfoserver.echoserver import EchoServer
 from craftinfoserver.echoclient import get_serverxml, get_servervalue
-from craftinfoserver.echoclient import get_serverinfo, generate_xml
\ No newline at end of file
+from craftinfoserver.echoclient import get_serverinfo, generate_xml, subscribe
+from craftinfoserver.echoclient import query_servers
+from craftinfoserver.echoclient import get_serverjson, request, EchoClient
+from craftinfoserver.metrics import Metrics
+from craftinfoserver.snapshot import Snapshot, SnapshotBuilder, build_snapshot
+from craftinfoserver.watcher import LogWatcher
\ No newline at end of file
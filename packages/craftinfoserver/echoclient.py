@@ -1,34 +1,123 @@
+import json
+from time import time
+
+import gevent
+import gevent.event
+import gevent.lock
 from gevent import socket
 import xml.etree.ElementTree as ET
 
-def get_serverxml(server, port):
-    c = socket.socket()
-    ip = socket.gethostbyname(server)
-    
+from craftinfoserver.snapshot import build_snapshot, render_xml, parse_binary
+
+# Seconds the address of a host is cached
+DNS_TTL = 300
+
+_addresses = dict()
+
+def resolve(host, ttl=DNS_TTL):
+    """Returns the IP address of the host, cached for ttl seconds."""
+    address, resolved = _addresses.get(host, (None, 0))
+    if address is None or time() - resolved >= ttl:
+        address = socket.gethostbyname(host)
+        _addresses[host] = (address, time())
+
+    return address
+
+def request(server, port, token, timeout=None):
+    """Sends the request token to the server and returns the whole answer.
+
+    Servers not knowing the token answer with the XML.
+
+    """
+    c = socket.create_connection((resolve(server), port), timeout)
     try:
-        c.connect((ip, port))
-        
-        xml = ""
-        while "</info>" not in xml:
-            xml = c.recv(1024)    
-            if xml is None:
-                break
-         
-        return xml
+        c.sendall(token + "\n")
+        return _read_all(c)
     finally:
         c.close()
 
+def _read_all(c):
+    """Returns the data received until the server closes the connection."""
+    data = []
+    while True:
+        chunk = c.recv(65536)
+        if not chunk:
+            break
+        data.append(chunk)
+
+    return ''.join(data)
+
+def get_serverxml(server, port):
+    return request(server, port, "XML")
+
 def get_servervalue(server, port):
-    c = socket.socket()
-    ip = socket.gethostbyname(server)
+    c = socket.create_connection((resolve(server), port))
     try:
-        c.connect((ip, port))
-        return c.recv(1024)
+        return _read_all(c)
     finally:
         c.close()
 
-def get_serverinfo(server, port):    
-    root = ET.fromstring(get_serverxml(server, port))
+def get_serverjson(server, port):
+    """Returns the info of the server decoded from JSON."""
+    return json.loads(request(server, port, "JSON"))
+
+def get_serverinfo(server, port, timeout=None):
+    """Returns the info of the server as dictionary.
+
+    The info is requested in the binary format. Servers not supporting it
+    send the XML instead, which is parsed in this case.
+
+    """
+    return parse_info(request(server, port, "BIN", timeout))
+
+def query_servers(targets, timeout=5, deadline=None, concurrency=100):
+    """Returns the info of many servers, queried concurrently.
+
+    Returns a dictionary of the info by target and a dictionary of the
+    exceptions by target for those that failed. Targets not answering
+    within the timeout, or before the deadline passed, fail with a
+    socket.timeout.
+
+    arguments:
+    targets -- list of (server, port) tuples
+    timeout -- seconds each server may take to answer
+    deadline -- seconds after which to return whatever was received
+    concurrency -- number of servers queried at once
+
+    """
+    infos = dict()
+    errors = dict()
+    semaphore = gevent.lock.BoundedSemaphore(concurrency)
+
+    def query(target):
+        with semaphore:
+            server, port = target
+            try:
+                with gevent.Timeout(timeout, socket.timeout("timed out")):
+                    infos[target] = get_serverinfo(server, port, timeout)
+            except Exception as e:
+                errors[target] = e
+
+    queries = [gevent.spawn(query, target) for target in set(targets)]
+    gevent.joinall(queries, timeout=deadline)
+    gevent.killall(queries)
+
+    for target in targets:
+        if target not in infos and target not in errors:
+            errors[target] = socket.timeout("deadline exceeded")
+
+    return infos, errors
+
+def parse_info(data):
+    """Returns the info in the binary format, or in the XML, as dictionary."""
+    if data.startswith("<"):
+        return parse_xml(data)
+
+    return parse_binary(data)
+
+def parse_xml(xml):
+    """Returns the info in the XML as dictionary."""
+    root = ET.fromstring(xml)
 
     info = dict()
 
@@ -45,27 +134,182 @@ def get_serverinfo(server, port):
     for update in root.find("updates").getchildren():
         info["updates"].append(update.text)
 
+    resources = root.find("resources")
+    if resources is not None:
+        info["resources"] = dict(
+            (child.tag, float(child.text) if child.tag == "cpu" else
+             int(child.text))
+            for child in resources.getchildren()
+        )
+
     return info
 
-def generate_xml(is_running, log, session, messages):
-    """Puts the info from the minecraft module together into an XML"""
+def subscribe(server, port, seq=None):
+    """Yields the snapshot and the changes pushed by the server.
 
-    log.update()
+    Each item is a dictionary with a type, a value and a sequence number.
+    The first item is the snapshot, unless seq is given and the server
+    still knows the changes after it. If a sequence number is skipped,
+    the connection is reopened to catch up. Stops if the server closes
+    the connection.
 
-    root = ET.Element('info')
+    """
+    while True:
+        c = socket.create_connection((server, port))
+        try:
+            c.sendall("SUBSCRIBE %s\n" % ('' if seq is None else seq))
 
-    online = ET.SubElement(root, 'online')
-    online.text = str(is_running())
+            for line in c.makefile('rb'):
+                change = json.loads(line)
 
-    players = ET.SubElement(root, 'players')
-    for nick in log.get_playerlist():
-        player = ET.SubElement(players, 'player')
-        player.text = nick
+                if change['type'] != 'snapshot' and seq is not None:
+                    if change['seq'] != seq + 1:
+                        break
 
-    updates = ET.SubElement(root, 'updates')
-    for msg in messages:
-        update = ET.SubElement(updates, 'update')
-        datetxt = msg.date.strftime("%d.%m.%Y - %H:%M")
-        update.text = "%s, %s" % (datetxt, msg.text)
-    
-    return ET.tostring(root)
\ No newline at end of file
+                seq = change['seq']
+                yield change
+            else:
+                return
+        finally:
+            c.close()
+
+class EchoClient(object):
+    """Client of one EchoServer, caching the info of the server.
+
+    The info is kept for ttl seconds. Greenlets asking for it while it is
+    fetched wait for the same fetch instead of starting their own.
+
+    If persistent is set, the info is fetched by HTTP over a single
+    connection kept open, which requires a server answering HTTP. The
+    ETag of the last answer is sent along, so the server only sends the
+    info again if it changed.
+
+    """
+
+    def __init__(self, server, port, ttl=1, persistent=False, timeout=5):
+        """Takes the address of the server.
+
+        arguments:
+        server -- host name or address of the server
+        port -- port of the server
+        ttl -- seconds the info is cached
+        persistent -- True to keep the connection open, using HTTP
+        timeout -- seconds to wait for the server
+
+        """
+        self.server = server
+        self.port = port
+        self.ttl = ttl
+        self.persistent = persistent
+        self.timeout = timeout
+        self._info = None
+        self._fetched = 0
+        self._fetch = None
+        self._socket = None
+        self._reader = None
+        self._answers = dict()
+
+    def get_info(self):
+        """Returns the info of the server as dictionary, as returned by
+        get_serverinfo.
+
+        """
+        if self._info is not None and time() - self._fetched < self.ttl:
+            return self._info
+
+        if self._fetch is not None:
+            return self._fetch.get()
+
+        self._fetch = gevent.event.AsyncResult()
+        try:
+            info = parse_info(self.request())
+        except Exception as e:
+            self._fetch.set_exception(e)
+            raise
+        else:
+            self._info = info
+            self._fetched = time()
+            self._fetch.set(info)
+            return info
+        finally:
+            self._fetch = None
+
+    def request(self, token="BIN"):
+        """Returns the answer of the server to the request token."""
+        if not self.persistent:
+            return request(self.server, self.port, token, self.timeout)
+
+        path = '/' + token.lower()
+        reused = self._socket is not None
+        try:
+            return self._request_http(path)
+        except socket.error:
+            self.close()
+            if not reused:
+                raise
+
+        # the server closed the connection kept open, retry on a new one
+        try:
+            return self._request_http(path)
+        except socket.error:
+            self.close()
+            raise
+
+    def close(self):
+        """Closes the connection kept open."""
+        if self._socket:
+            self._socket.close()
+        self._socket = None
+        self._reader = None
+
+    def _connect(self):
+        address = (resolve(self.server), self.port)
+        self._socket = socket.create_connection(address, self.timeout)
+        self._reader = self._socket.makefile('rb')
+
+    def _request_http(self, path):
+        """Returns the body of the answer to a HTTP request of the path."""
+        if self._socket is None:
+            self._connect()
+
+        lines = ["GET %s HTTP/1.1" % path, "Host: %s" % self.server]
+        etag, data = self._answers.get(path, (None, None))
+        if etag:
+            lines.append("If-None-Match: %s" % etag)
+        self._socket.sendall("\r\n".join(lines) + "\r\n\r\n")
+
+        status = self._reader.readline().split()
+        if len(status) < 2:
+            raise socket.error("connection closed")
+
+        headers = dict()
+        for line in iter(self._reader.readline, "\r\n"):
+            if not line:
+                raise socket.error("connection closed")
+            name, sep, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", 0))
+        body = self._reader.read(length)
+        if len(body) < length:
+            raise socket.error("connection closed")
+
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+
+        if status[1] == "304":
+            return data
+        if status[1] != "200":
+            raise ValueError("server answered %s" % " ".join(status[1:]))
+
+        self._answers[path] = (headers.get("etag"), body)
+        return body
+
+def generate_xml(is_running, log, session, messages, name=None):
+    """Puts the info from the minecraft module together into an XML
+
+    If a name is given, it is set as server attribute of the root, telling
+    apart the info of multiple servers.
+
+    """
+    return render_xml(build_snapshot(is_running, log, messages, name))
\ No newline at end of file
@@ -6,17 +6,59 @@
 Listens on a configured port and returns the value from a 
 callback function.
 
-The requested information is preemptively cached each 30 seconds.
+The requested information is preemptively cached. The cache is rebuilt
+when it is invalidated or when it is older than 30 seconds.
+
+Clients connecting to the port get the value right away. On a separate
+request port, clients send a request token first, for example to
+subscribe to the changes of the value.
+
+Optionally, a minimal HTTP endpoint is served on the request port, so
+browsers and monitoring tools can poll the JSON without a separate
+web application.
 
 """
 
 import os
+import json
 import time
+import hashlib
+import traceback
+from collections import deque
 from datetime import datetime
 
 import gevent
 import gevent.event
+import gevent.queue
 from gevent import socket
+from gevent.pool import Pool
+from gevent.server import StreamServer
+
+from craftinfoserver.metrics import Metrics
+from craftinfoserver.snapshot import Snapshot, RENDERERS, diff_snapshots
+
+# Number of changes a subscriber may lag behind before being dropped
+SUBSCRIBER_QUEUE = 1000
+
+# Maximal number of bytes of the header of a HTTP request
+HTTP_MAX_HEADER = 8192
+
+# Request tokens and content types of the renderings served by HTTP paths
+HTTP_PATHS = {
+    '/': ('JSON', 'application/json'),
+    '/json': ('JSON', 'application/json'),
+    '/xml': ('XML', 'text/xml; charset=utf-8'),
+    '/bin': ('BIN', 'application/octet-stream'),
+    '/metrics': ('METRICS', 'text/plain; version=0.0.4'),
+}
+
+HTTP_REASONS = {
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+}
 
 class EchoServer():
     """Socketserver echoing any string value on any specified port.
@@ -25,66 +67,550 @@ class EchoServer():
     object passed on construction. This callback function will be called
     each 30 seconds per default. This interval can be changed anytime.
 
+    Calling invalidate causes the callback to be called right away, but
+    not more than once within the coalescing window. Invalidations
+    within the window are handled by a single call. If the callback
+    raises an exception, the last value is kept until the next call.
+
+    The value is stored encoded, ready to be sent.
+
+    The value is sent to clients connecting to the port right away,
+    without reading anything. Clients connecting to the request port
+    send a request token terminated by a newline first. An empty token
+    requests the value as well.
+
+    If the callback returns a Snapshot instead of a string, its XML is
+    the value. The snapshot is also rendered to JSON and a binary format,
+    which clients request by sending 'JSON' or 'BIN' (or 'XML').
+
+    Clients can also subscribe by sending 'SUBSCRIBE'. They
+    get the snapshot as a line of JSON, followed by a line for each
+    change pushed as soon as it happened. Each line has a sequence
+    number. After a gap, clients may subscribe with 'SUBSCRIBE <seq>',
+    giving the last sequence number received, to get the missed changes.
+
+    At most max_connections are handled at once on both ports, including
+    subscribers. Further connections wait in the backlog of the listening
+    socket until a connection is closed.
+
+    The server measures itself into the metrics registry given. Clients
+    sending 'METRICS' get the metrics in the Prometheus text format.
+
+    If http is set, requests starting with 'GET' or 'HEAD' to the request
+    port are answered by HTTP/1.1. The path '/' (or '/json') serves the
+    JSON, '/xml' and '/bin' the other renderings, '/metrics' the metrics.
+    Responses carry the hash of their body as ETag, computed once per
+    generation of the value. Requests with a matching If-None-Match are
+    answered by 304 without a body. Connections are kept alive for
+    further requests unless the client asks to close them.
+
     """
 
-    def __init__(self, port, callback, interval=30):
+    def __init__(self, port, callback, interval=30, coalesce=0.5,
+                 negotiate=5, history=1000, backlog=128,
+                 max_connections=1000, write_timeout=10, drain=5,
+                 share=None, http=False, keepalive=5, metrics=None,
+                 request_port=None):
         """Takes the logfile to read and the port to listen to.
 
         arguments:
-        port -- port to listen on
+        port -- port sending the value right away, None for none
         callback -- function to call for the echo-value (no parameters)
-        interval -- interval in seconds with which callback will be polled
+        interval -- interval in seconds with which callback will be polled,
+                    None to only call it if invalidated
+        coalesce -- minimal number of seconds between calls of callback
+        negotiate -- seconds to wait for the request token of a client
+                     of the request port
+        history -- number of changes kept for subscribers to catch up
+        backlog -- number of connections waiting to be accepted
+        max_connections -- number of connections handled at once
+        write_timeout -- seconds a send to a client may take
+        drain -- seconds to wait for open connections on stop
+        share -- function called with the values by token and the value
+                 after each change, to share them with other processes
+        http -- True to answer HTTP requests
+        keepalive -- seconds to wait for the next request on a HTTP
+                     connection kept alive
+        metrics -- Metrics registry to measure into, a new one if None
+        request_port -- port answering request tokens, None for none
+
+        If neither port is given, the value is only built.
         
         """
         self.port = port
-        self.show_output = True
-        self.interval = 30
+        self.request_port = request_port
+        self.show_output = False
+        self.interval = interval
+        self.coalesce = coalesce
+        self.negotiate = negotiate
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.write_timeout = write_timeout
+        self.drain = drain
+        self.keepalive = keepalive
+        self.servers = []
+        self.value = None
+        self.values = dict()
+        self.snapshot = None
+        self.generation = 0
+        self.seq = 0
         self._stop = False        
         self._callback = callback
+        self._share = share
+        self._cacheloop = None
+        self._invalidated = gevent.event.Event()
+        self._changes = deque(maxlen=history)
+        self._subscribers = set()
+        self._etags = dict()
+        self._protocols = {
+            'SUBSCRIBE': self._handle_subscription,
+        }
+        for token in RENDERERS:
+            self._protocols[token] = self._handle_rendering
+        self._protocols['METRICS'] = self._handle_metrics
+        if http:
+            self._protocols['GET'] = self._handle_http
+            self._protocols['HEAD'] = self._handle_http
+
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+        self._latency = metrics.histogram(
+            'craftinfo_response_seconds',
+            'Seconds from accepting a connection until the response is sent'
+        )
+        self._sent = metrics.counter(
+            'craftinfo_sent_bytes_total', 'Bytes sent to clients'
+        )
+        self._connections = metrics.gauge(
+            'craftinfo_connections', 'Connections currently open'
+        )
+        self._accepted = metrics.counter(
+            'craftinfo_connections_total', 'Connections accepted'
+        )
+        self._rebuilds = metrics.histogram(
+            'craftinfo_rebuild_seconds', 'Seconds to rebuild the value'
+        )
+        self._rebuild_errors = metrics.counter(
+            'craftinfo_rebuild_errors_total', 'Calls of the callback failed'
+        )
     
     def stop(self):
-        """Causes the server to stop."""
+        """Causes the server to stop.
+
+        No more connections are accepted. Open connections are given the
+        drain timeout to complete, subscriptions are ended.
+
+        """
         self._stop = True
         print "stopping"
-        self._cacheloop.kill()
-        self._mainloop.join()
-        self.socket.close()
+        for queue in list(self._subscribers):
+            queue.put(None)
+        if self._cacheloop:
+            self._cacheloop.kill()
+        for server in self.servers:
+            server.close()
+        for server in self.servers:
+            server.stop(timeout=self.drain)
+        print "goodbye, cruel world"
     
+    def invalidate(self):
+        """Causes the value to be updated without waiting for the interval.
+
+        To be called whenever the information behind the value changed.
+
+        """
+        self._invalidated.set()
+
     def start(self):
         """Start the server."""
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._rebuild()
+
+        self._cacheloop = gevent.spawn(self._cache_forever)
+
+        self._serve()
+
+    def _serve(self):
+        """ Starts accepting connections on the ports given. """
+        pool = Pool(self.max_connections)
+
+        handlers = [
+            (self.port, self._handle_connection),
+            (self.request_port, self._handle_request),
+        ]
+        for port, handler in handlers:
+            if port is not None:
+                server = StreamServer(self._listen(port), handler, spawn=pool)
+                server.start()
+                self.servers.append(server)
+
+    def _listen(self, port):
+        """ Returns the socket listening on the port. """
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
         # For some reason the sockets are closed by the system gc on unix
         # instead of the python gc, resulting in sockets that are kept open
         # after shutting down the server. Until this is solved, reuse
         # addresses to enable fast restarting.
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         
-        self.socket.bind(('', self.port))
-        self.socket.listen(5)
-        self.socket.settimeout(1)
-
-        self._cacheloop = gevent.spawn(self._cache_forever)
-        self._mainloop = gevent.spawn(self._serve_forever)
+        listener.bind(('', port))
+        listener.listen(self.backlog)
+        return listener
 
     def _cache_forever(self):
-        """ Gets the value of the callback in the given interval until
-        the server is stopped. """
+        """ Gets the value of the callback if invalidated or in the given
+        interval until the server is stopped. """
         while not self._stop:
-            get = gevent.spawn(self._callback)
-            while not get.ready():
-                gevent.sleep(0)
+            gevent.sleep(self.coalesce)
+
+            if self.interval is None:
+                timeout = None
+            else:
+                timeout = max(0, self.interval - self.coalesce)
 
-            self.value = get.value
-            gevent.sleep(self.interval)
+            self._invalidated.wait(timeout)
+            self._invalidated.clear()
+
+            try:
+                self._rebuild()
+            except Exception:
+                # e.g. a locked database, keep serving the last value
+                self._rebuild_errors.inc()
+                traceback.print_exc()
+
+    def _rebuild(self):
+        """ Builds the value, measuring the time it took. """
+        with self._rebuilds.time():
+            self._build()
+
+    def _build(self):
+        """ Stores the value of the callback, encoded to be sent. The
+        generation is increased if the value changed. """
+        value = self._callback()
+
+        if isinstance(value, Snapshot):
+            self._publish(value)
+            values = dict(
+                (token, self._encode(render(value)))
+                for token, render in RENDERERS.items()
+            )
+            value = values['XML']
+        else:
+            values = dict()
+            value = self._encode(value)
+
+        if value == self.value and values == self.values:
+            return
+
+        self.values = values
+        self.value = value
+        self.generation += 1
+
+        if self._share:
+            self._share(self.values, self.value)
+
+    def _get_value(self, token=''):
+        """ Returns the value to send for the requested token. """
+        return self.values.get(token, self.value)
+
+    def _read_value(self, token=''):
+        """ Returns the generation and the value to send for the token. """
+        return self.generation, self._get_value(token)
+
+    def _get_etag(self, token, generation, value):
+        """ Returns the ETag of the value, the hash of the value being
+        cached for the generation. Unlike the generation, which restarts
+        with the process, the hash only matches the same value. """
+        cached = self._etags.get(token)
+        if cached and cached[0] == generation:
+            return cached[1]
+
+        etag = '"%s"' % hashlib.sha1(value).hexdigest()[:20]
+        self._etags[token] = (generation, etag)
+        return etag
+
+    def _encode(self, value):
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
+
+    def _publish(self, snapshot):
+        """ Pushes the changes since the last snapshot to the subscribers. """
+        if self.snapshot is not None:
+            for change in diff_snapshots(self.snapshot, snapshot):
+                self.seq += 1
+                change['seq'] = self.seq
+                line = json.dumps(change) + '\n'
+
+                self._changes.append((self.seq, line))
+                for queue in list(self._subscribers):
+                    # drop subscribers not keeping up, they have to resync
+                    if queue.qsize() >= SUBSCRIBER_QUEUE:
+                        self._subscribers.discard(queue)
+                        queue.put(None)
+                    else:
+                        queue.put(line)
+
+        self.snapshot = snapshot
             
-    def _handle_connection(self, new_socket):
-        """ Writes the value to the client-socket, making sure it is
-        closed afterwards. """
+    def _handle_connection(self, new_socket, address):
+        """ Writes the value to the client-socket right away. """
+        self._handle(new_socket, address, False)
+
+    def _handle_request(self, new_socket, address):
+        """ Hands the client-socket to the handler of the requested
+        protocol, or writes the value if there is none. """
+        self._handle(new_socket, address, True)
+
+    def _handle(self, new_socket, address, requested):
+        """ Answers the client, making sure the socket is closed
+        afterwards. """
+        starttime = self._get_tick()
+        self._accepted.inc()
+        self._connections.inc()
         try:
-            new_socket.send(self.value)
+            new_socket.settimeout(self.write_timeout)
+
+            if requested:
+                data = self._read_request(new_socket)
+                token = data.split(None, 1)[0].upper() if data.strip() else ''
+                handler = self._protocols.get(token)
+            else:
+                handler = None
+
+            if handler:
+                handler(new_socket, data, starttime)
+            else:
+                self._respond(new_socket, self._get_value(), starttime)
+                if not requested:
+                    self._discard_request(new_socket)
+        except socket.error:
+            pass
         finally:
             new_socket.close()
+            self._connections.dec()
+            self._print_connection(address, starttime)
+
+    def _send(self, new_socket, data):
+        """ Sends all of the data, counting the bytes sent. """
+        new_socket.sendall(data)
+        self._sent.inc(len(data))
+
+    def _respond(self, new_socket, data, starttime):
+        """ Sends the response, measuring the time since starttime. """
+        self._send(new_socket, data)
+        self._latency.observe(self._get_tick() - starttime)
+
+    def _discard_request(self, new_socket):
+        """ Reads what a client sent to the port anyway, as closing a
+        socket with unread data resets the connection, which might
+        discard the value before the client read it. """
+        new_socket.settimeout(0)
+        try:
+            new_socket.recv(1024)
+        except socket.error:
+            pass
+
+    def _read_request(self, new_socket):
+        """ Returns the data sent by the client within the negotiation
+        timeout or an empty string. """
+        new_socket.settimeout(self.negotiate)
+        try:
+            data = new_socket.recv(1024)
+        except (socket.timeout, socket.error):
+            data = ''
+        finally:
+            new_socket.settimeout(self.write_timeout)
+
+        return data
+
+    def _handle_rendering(self, new_socket, data, starttime):
+        """ Sends the requested rendering of the snapshot. """
+        token = data.split(None, 1)[0].upper()
+        self._respond(new_socket, self._get_value(token), starttime)
+
+    def _handle_metrics(self, new_socket, data, starttime):
+        """ Sends the metrics in the Prometheus text format. """
+        self._respond(new_socket, self._render_metrics(), starttime)
+
+    def _render_metrics(self):
+        return self.metrics.render().encode('utf-8')
+
+    def _handle_http(self, new_socket, data, starttime):
+        """ Answers HTTP requests until the client closes the connection
+        or doesn't send the next request within the keepalive timeout. """
+        while not self._stop:
+            while '\r\n\r\n' not in data and '\n\n' not in data:
+                if len(data) > HTTP_MAX_HEADER:
+                    self._send_http(new_socket, 400, keepalive=False)
+                    return
+
+                if data:
+                    chunk = new_socket.recv(4096)
+                else:
+                    chunk = self._wait_request(new_socket)
+                    starttime = self._get_tick()
+                if not chunk:
+                    return
+                data += chunk
+
+            head, data = self._split_head(data)
+            lines = head.splitlines()
+
+            try:
+                method, path, version = lines[0].split()
+            except ValueError:
+                self._send_http(new_socket, 400, keepalive=False)
+                return
+
+            headers = dict()
+            for line in lines[1:]:
+                name, sep, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            if 'content-length' in headers or 'transfer-encoding' in headers:
+                # request bodies aren't read, the connection can't be reused
+                self._send_http(new_socket, 405, keepalive=False)
+                return
+
+            keepalive = self._is_keepalive(version, headers)
+            self._answer_http(
+                new_socket, method, path, headers, keepalive, starttime
+            )
+            if not keepalive:
+                return
+
+            starttime = self._get_tick()
+
+    def _answer_http(self, new_socket, method, path, headers, keepalive,
+                     starttime):
+        """ Sends the response to a single HTTP request. """
+        if method not in ('GET', 'HEAD'):
+            self._send_http(new_socket, 405, keepalive=keepalive)
+            return
+
+        path = path.split('?', 1)[0]
+        if path not in HTTP_PATHS:
+            self._send_http(new_socket, 404, keepalive=keepalive)
+            return
+
+        token, content_type = HTTP_PATHS[path]
+        if token == 'METRICS':
+            self._send_http(
+                new_socket, 200, self._render_metrics(), content_type,
+                keepalive=keepalive, head=method == 'HEAD',
+                starttime=starttime
+            )
+            return
+
+        generation, body = self._read_value(token)
+        etag = self._get_etag(token, generation, body)
+
+        tags = headers.get('if-none-match', '')
+        tags = [tag.strip() for tag in tags.split(',')]
+        if etag in tags or 'W/' + etag in tags or '*' in tags:
+            self._send_http(
+                new_socket, 304, etag=etag, keepalive=keepalive,
+                starttime=starttime
+            )
+            return
+
+        self._send_http(
+            new_socket, 200, body, content_type, etag, keepalive,
+            method == 'HEAD', starttime
+        )
+
+    def _send_http(self, new_socket, status, body='', content_type=None,
+                   etag=None, keepalive=True, head=False, starttime=None):
+        """ Sends a HTTP response with the status and body, measuring the
+        time since starttime if given. """
+        lines = ['HTTP/1.1 %i %s' % (status, HTTP_REASONS[status])]
+        if status != 304:
+            lines.append('Content-Length: %i' % len(body))
+        if content_type:
+            lines.append('Content-Type: %s' % content_type)
+        if etag:
+            lines.append('ETag: %s' % etag)
+            lines.append('Cache-Control: no-cache')
+        if not keepalive:
+            lines.append('Connection: close')
+
+        self._send(new_socket, '\r\n'.join(lines) + '\r\n\r\n')
+        if body and not head:
+            self._send(new_socket, body)
+
+        if starttime is not None:
+            self._latency.observe(self._get_tick() - starttime)
+
+    def _wait_request(self, new_socket):
+        """ Returns the start of the next request on a connection kept
+        alive, or an empty string if none is sent in time. """
+        new_socket.settimeout(self.keepalive)
+        try:
+            return new_socket.recv(4096)
+        except socket.timeout:
+            return ''
+        finally:
+            new_socket.settimeout(self.write_timeout)
+
+    def _split_head(self, data):
+        """ Returns the header of the first request and the data after. """
+        for separator in ('\r\n\r\n', '\n\n'):
+            index = data.find(separator)
+            if index != -1:
+                return data[:index], data[index + len(separator):]
+
+    def _is_keepalive(self, version, headers):
+        """ Returns True if the connection is kept open after the response. """
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            return connection != 'close'
+        return connection == 'keep-alive'
+
+    def _handle_subscription(self, new_socket, data, starttime):
+        """ Sends the snapshot, or the changes missed since the given
+        sequence number, followed by the changes as they happen. """
+        if self.snapshot is None:
+            self._send(new_socket, self._get_value())
+            return
+
+        args = data.split('\n', 1)[0].split()
+        lastseq = int(args[1]) if len(args) > 1 and args[1].isdigit() else None
+
+        queue = gevent.queue.Queue()
+        self._subscribers.add(queue)
+
+        try:
+            if lastseq is not None and self._can_resume(lastseq):
+                for seq, line in self._changes:
+                    if seq > lastseq:
+                        self._send(new_socket, line)
+            else:
+                snapshot = dict(
+                    type='snapshot', seq=self.seq,
+                    value=self.snapshot.to_dict()
+                )
+                self._send(new_socket, json.dumps(snapshot) + '\n')
+
+            while not self._stop:
+                line = queue.get()
+                if line is None:
+                    break
+                self._send(new_socket, line)
+        except socket.error:
+            pass
+        finally:
+            self._subscribers.discard(queue)
+
+    def _can_resume(self, lastseq):
+        """ Returns True if the changes after lastseq are available. """
+        if lastseq == self.seq:
+            return True
+        if not self._changes or lastseq > self.seq:
+            return False
+
+        return self._changes[0][0] <= lastseq + 1
     
     def _print_connection(self, address, starttime):
         """ Prints a connection log. """
@@ -105,19 +631,3 @@ class EchoServer():
             return time.clock()
         else:
             return time.time()
-
-    def _serve_forever(self):
-        """Main-loop handling incoming connections."""
-        while not self._stop:
-            try:
-                new_socket, address = self.socket.accept()
-                starttime = self._get_tick()
-                gevent.spawn_raw(self._handle_connection, new_socket)
-                gevent.spawn_raw(self._print_connection, address, starttime)
-            except (socket.timeout, socket.error):
-                pass
-            finally:
-                gevent.sleep(0)
-
-        self.socket.close()
-        print "goodbye, cruel world"
\ No newline at end of file
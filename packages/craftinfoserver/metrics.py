@@ -0,0 +1,230 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Counters and histograms measuring the servers at runtime.
+
+The metrics are kept in a registry and are cheap to update, nothing is
+computed until they are rendered. They are rendered as text for the
+console, or in the text format scraped by Prometheus.
+
+Histograms have fixed buckets, so their memory doesn't grow with the
+number of observations. Quantiles are estimated by the upper bound of
+the bucket they fall into.
+
+"""
+
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+# Upper bounds of the buckets of histograms measuring seconds
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1, 2.5, 5, 10,
+)
+
+class Counter(object):
+    """Number that is only increased.
+
+    If a function is given, it is called for the value instead, which
+    exposes a number counted elsewhere.
+
+    """
+
+    kind = 'counter'
+
+    def __init__(self, function=None):
+        self.value = 0
+        self._function = function
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get(self):
+        if self._function:
+            return self._function()
+        return self.value
+
+class Gauge(Counter):
+    """Number that goes up and down."""
+
+    kind = 'gauge'
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+class Histogram(object):
+    """Counts observations in buckets with fixed upper bounds."""
+
+    kind = 'histogram'
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def time(self):
+        """Returns a context manager observing the seconds it took."""
+        return _Timer(self)
+
+    def get_quantile(self, quantile):
+        """Returns the upper bound of the bucket the quantile (0 to 1)
+        falls into, infinity if it is above the largest bucket. Returns
+        None if nothing was observed.
+
+        """
+        if not self.count:
+            return None
+
+        rank = quantile * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+
+        return float('inf')
+
+class _Timer(object):
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.starttime = None
+
+    def __enter__(self):
+        self.starttime = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.time() - self.starttime)
+
+class Metrics(object):
+    """Registry of the metrics of a process.
+
+    Metrics are created by name. Getting a metric by the same name and
+    labels again returns the existing one. Views created by labelled
+    share the registry, adding their labels to the metrics created
+    through them, which tells apart the metrics of multiple servers.
+
+    """
+
+    def __init__(self, labels=None, families=None):
+        self.labels = labels or dict()
+        if families is None:
+            families = OrderedDict()
+        self._families = families
+
+    def labelled(self, **labels):
+        """Returns a view of the registry adding the labels."""
+        merged = dict(self.labels)
+        merged.update(labels)
+        return Metrics(merged, self._families)
+
+    def counter(self, name, help, function=None):
+        return self._get(name, help, Counter, function)
+
+    def gauge(self, name, help, function=None):
+        return self._get(name, help, Gauge, function)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._get(name, help, Histogram, buckets)
+
+    def _get(self, name, help, cls, *args):
+        """Returns the metric by name and the labels of the view, created
+        if it doesn't exist yet.
+
+        Raises a ValueError if a metric of another kind has the name.
+
+        """
+        if name not in self._families:
+            self._families[name] = (cls, help, OrderedDict())
+
+        family_cls, help, metrics = self._families[name]
+        if family_cls is not cls:
+            raise ValueError("%s is a %s" % (name, family_cls.kind))
+
+        key = tuple(sorted(self.labels.items()))
+        if key not in metrics:
+            metrics[key] = cls(*args)
+
+        return metrics[key]
+
+    def render(self):
+        """Returns the metrics in the Prometheus text format."""
+        lines = []
+        for name, (cls, help, metrics) in self._families.items():
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, cls.kind))
+
+            for key, metric in metrics.items():
+                if cls is not Histogram:
+                    lines.append(_format_sample(name, key, metric.get()))
+                    continue
+
+                total = 0
+                bounds = metric.buckets + (float('inf'),)
+                for bound, count in zip(bounds, metric.counts):
+                    total += count
+                    labels = key + (('le', _format_number(bound)),)
+                    lines.append(_format_sample(name + '_bucket', labels, total))
+
+                lines.append(_format_sample(name + '_sum', key, metric.sum))
+                lines.append(_format_sample(name + '_count', key, metric.count))
+
+        return '\n'.join(lines) + '\n'
+
+    def get_stats(self):
+        """Returns a line of text for each metric, histograms summarized
+        by their count, mean and estimated quantiles.
+
+        """
+        lines = []
+        for name, (cls, help, metrics) in self._families.items():
+            for key, metric in metrics.items():
+                label = name + _format_labels(key)
+
+                if cls is not Histogram:
+                    value = _format_number(metric.get())
+                elif metric.count:
+                    value = "count %i, mean %.4f, p50 %s, p99 %s, p999 %s" % (
+                        metric.count, metric.sum / metric.count,
+                        _format_number(metric.get_quantile(0.5)),
+                        _format_number(metric.get_quantile(0.99)),
+                        _format_number(metric.get_quantile(0.999)),
+                    )
+                else:
+                    value = "count 0"
+
+                lines.append("%s\t%s" % (label, value))
+
+        return lines
+
+def _format_sample(name, labels, value):
+    return '%s%s %s' % (name, _format_labels(labels), _format_number(value))
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    pairs = []
+    for name, value in labels:
+        value = unicode(value).replace('\\', '\\\\').replace('"', '\\"')
+        pairs.append('%s="%s"' % (name, value.replace('\n', '\\n')))
+
+    return '{%s}' % ','.join(pairs)
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
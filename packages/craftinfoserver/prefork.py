@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Serves the values of EchoServers from multiple worker processes.
+
+A single producer process owns the log, the database and the process
+scan. It publishes the values of its EchoServers into shared memory,
+from where the workers send them straight to the clients. The workers
+accept on the same ports (SO_REUSEPORT), so the kernel spreads the
+connections over all cores while the values are built only once.
+
+Only available on platforms supporting fork and SO_REUSEPORT.
+
+"""
+
+import os
+import mmap
+import signal
+import struct
+
+import gevent
+import gevent.event
+import gevent.local
+from gevent import socket
+
+from craftinfoserver.echoserver import EchoServer
+
+# Number of slots the values are written to in turn
+SLOTS = 8
+
+# Maximal number of bytes of all values published at once
+SLOT_SIZE = 4 * 1024 * 1024
+
+# Linux value, missing in the socket module of older Pythons
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+
+GENERATION = struct.Struct('=Q')
+COUNT = struct.Struct('=H')
+ENTRY = struct.Struct('=8sII')
+
+# SO_LINGER option closing a socket by resetting the connection
+RESET = struct.pack('ii', 1, 0)
+
+class SharedValues(object):
+    """Values shared between processes through anonymous shared memory.
+
+    Has to be created before forking. One process publishes the values,
+    the others read them. Each publication is written to the next of the
+    slots and then announced by increasing the generation, so readers
+    never see a partially written publication. A reader still sending
+    from a slot when it is reused sends mixed data, which is_reused tells
+    after the send.
+
+    """
+
+    def __init__(self, slotsize=SLOT_SIZE, slots=SLOTS):
+        self.slotsize = slotsize
+        self.slots = slots
+        self._mmap = mmap.mmap(-1, GENERATION.size + slots * slotsize)
+        self._generation = 0
+        self._table = dict()
+
+    def get_generation(self):
+        """Returns the number of publications so far."""
+        return GENERATION.unpack_from(self._mmap, 0)[0]
+
+    def publish(self, values, value):
+        """Writes the values by token and the default value.
+
+        Raises a ValueError if they don't fit into a slot.
+
+        """
+        items = values.items() + [('', value)]
+
+        offset = COUNT.size + ENTRY.size * len(items)
+        if offset + sum(len(data) for token, data in items) > self.slotsize:
+            raise ValueError("values exceed the slot size")
+
+        generation = self.get_generation() + 1
+        base = self._get_base(generation)
+
+        COUNT.pack_into(self._mmap, base, len(items))
+        for i, (token, data) in enumerate(items):
+            position = base + COUNT.size + ENTRY.size * i
+            ENTRY.pack_into(self._mmap, position, token, offset, len(data))
+
+            self._mmap[base + offset:base + offset + len(data)] = data
+            offset += len(data)
+
+        GENERATION.pack_into(self._mmap, 0, generation)
+
+    def get(self, token=''):
+        """Returns a buffer of the value published for the token, or the
+        default value if there is none. Returns None before the first
+        publication.
+
+        """
+        return self.read(token)[1]
+
+    def read(self, token=''):
+        """Returns the generation and the buffer returned by get."""
+        generation = self.get_generation()
+        if not generation:
+            return generation, None
+
+        if generation != self._generation:
+            self._table = self._read_table(generation)
+            self._generation = generation
+
+        offset, length = self._table.get(token) or self._table['']
+        return generation, buffer(self._mmap, offset, length)
+
+    def is_reused(self, generation):
+        """Returns True if the slot of the generation might have been
+        written to by a later publication.
+
+        """
+        return self.get_generation() + 1 - generation >= self.slots
+
+    def _get_base(self, generation):
+        return GENERATION.size + (generation % self.slots) * self.slotsize
+
+    def _read_table(self, generation):
+        """Returns the offsets and lengths of the values by token."""
+        base = self._get_base(generation)
+        count, = COUNT.unpack_from(self._mmap, base)
+
+        table = dict()
+        for i in xrange(count):
+            position = base + COUNT.size + ENTRY.size * i
+            token, offset, length = ENTRY.unpack_from(self._mmap, position)
+            table[token.rstrip('\0')] = (base + offset, length)
+
+        return table
+
+class WorkerServer(EchoServer):
+    """EchoServer sending the values published by the producer process.
+
+    Subscriptions are not supported, subscribers get the value instead.
+    The metrics served are the ones of the worker, the producer doesn't
+    see its connections.
+
+    If the slot of a value was reused while it was sent, the connection
+    is reset instead of closed, so the client doesn't take the mixed data
+    for a value.
+
+    """
+
+    def __init__(self, port, request_port, shared, **options):
+        EchoServer.__init__(
+            self, port, None, request_port=request_port, **options
+        )
+        self.shared = shared
+
+        # generation of the value read by the greenlet of each connection
+        self._local = gevent.local.local()
+
+    def start(self):
+        """Starts accepting connections."""
+        self._serve()
+
+    def _get_value(self, token=''):
+        return self._read_value(token)[1]
+
+    def _read_value(self, token=''):
+        self._local.generation, value = self.shared.read(token)
+        return self._local.generation, value or ''
+
+    def _send(self, new_socket, data):
+        EchoServer._send(self, new_socket, data)
+
+        # only the values are sent from the slots
+        if not isinstance(data, buffer):
+            return
+
+        if self.shared.is_reused(self._local.generation):
+            new_socket.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, RESET)
+            raise socket.error("value overwritten while sending")
+
+    def _listen(self, port):
+        """ Returns a socket listening on the port shared by all workers. """
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+
+        listener.bind(('', port))
+        listener.listen(self.backlog)
+        return listener
+
+def fork_workers(servers, count, **options):
+    """Forks worker processes serving the shared values.
+
+    Has to be called before any greenlets or threads are started, as they
+    would be run by the workers as well.
+
+    arguments:
+    servers -- list of (port, request port, SharedValues) tuples, the
+               ports as taken by EchoServer
+    count -- number of processes to fork
+    options -- further arguments of the WorkerServers
+
+    Returns the process ids of the workers.
+
+    """
+    pids = []
+    for i in range(count):
+        pid = gevent.fork()
+        if pid == 0:
+            _run_worker(servers, options)
+        pids.append(pid)
+
+    return pids
+
+def stop_workers(pids):
+    """Stops the workers, waiting for them to drain their connections."""
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+    for pid in pids:
+        try:
+            os.waitpid(pid, 0)
+        except OSError:
+            pass
+
+def _run_worker(servers, options):
+    """Serves until SIGTERM is received, never returns."""
+    try:
+        workers = [
+            WorkerServer(port, request_port, shared, **options)
+            for port, request_port, shared in servers
+        ]
+        for worker in workers:
+            worker.start()
+
+        stop = gevent.event.Event()
+        handler = getattr(gevent, 'signal_handler', None) or gevent.signal
+        handler(signal.SIGTERM, stop.set)
+        stop.wait()
+
+        for worker in workers:
+            for server in worker.servers:
+                server.stop(timeout=worker.drain)
+    finally:
+        os._exit(0)
@@ -0,0 +1,387 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""The info about a Minecraft server at one point in time.
+
+A Snapshot is built from the log, the process list and the messages. It
+is rendered to the XML sent to the clients and can be compared to an
+earlier snapshot, resulting in the changes in between.
+
+Besides XML, snapshots are rendered to JSON and to a compact binary
+format, which is the cheapest to parse. The binary format consists of:
+
+magic -- the bytes 'CI' followed by the format version 1
+length -- 4 bytes, number of bytes following
+flags -- 1 byte, the lowest bit is set if the server is online, the
+         second if the resources follow the updates
+server -- string with the name of the server, empty if not set
+players -- 2 bytes count of strings, followed by the strings
+updates -- 2 bytes count of strings, followed by the strings
+resources -- optional, 4 bytes cpu usage in tenths of a percent, 8 bytes
+             resident memory, 8 bytes maximal resident memory and 2 bytes
+             number of threads
+
+Strings are prefixed with their length in 2 bytes and UTF-8 encoded.
+Numbers are unsigned and big-endian. Readers ignore data following the
+parts they know.
+
+The renderings are stitched together from fragments of the sections of
+the snapshot (online, players and updates). The SnapshotBuilder passes
+the fragments of the sections that didn't change on to the next
+snapshot, so only the changed sections are rendered again.
+
+"""
+
+import json
+import struct
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+BINARY_MAGIC = 'CI\x01'
+
+BINARY_HEADER = struct.Struct('>3sI')
+
+BINARY_RESOURCES = struct.Struct('>IQQH')
+
+FLAG_ONLINE = 1
+FLAG_RESOURCES = 2
+
+# Keys of the resources of the server process, see ResourceSampler
+RESOURCES = ('cpu', 'rss', 'rss_max', 'threads')
+
+class Snapshot(object):
+    """Holds the state of a server provided to the clients."""
+
+    __slots__ = ('online', 'players', 'updates', 'server', 'versions',
+                 'resources', '_fragments')
+
+    def __init__(self, online, players, updates, server=None, versions=None,
+                 resources=None):
+        """Takes the state of the server.
+
+        arguments:
+        online -- True if the server process is running
+        players -- list of names of the players online
+        updates -- list of message texts, newest first
+        server -- name of the server, if multiple servers are run
+        versions -- versions of the sections by name, equal to the ones
+                    of an earlier snapshot if the section didn't change
+        resources -- dictionary of the resources used by the server
+                     process with the keys in RESOURCES, if sampled
+
+        """
+        self.online = online
+        self.players = list(players)
+        self.updates = list(updates)
+        self.server = server
+        self.versions = versions or dict()
+        self.resources = resources
+        self._fragments = dict()
+
+    def to_dict(self):
+        info = dict(
+            online=self.online, players=self.players, updates=self.updates
+        )
+        if self.server:
+            info['server'] = self.server
+        if self.resources:
+            info['resources'] = self.resources
+
+        return info
+
+    def get_fragment(self, section, format, render):
+        """Returns the rendering of the section in the format, calling
+        render for it only once.
+
+        """
+        key = (section, format)
+        if key not in self._fragments:
+            self._fragments[key] = render()
+
+        return self._fragments[key]
+
+    def reuse(self, old):
+        """Takes over the fragments of the sections of the old snapshot
+        having the same versions.
+
+        """
+        for (section, format), fragment in old._fragments.items():
+            version = self.versions.get(section)
+            if version is not None and version == old.versions.get(section):
+                self._fragments.setdefault((section, format), fragment)
+
+class SnapshotBuilder(object):
+    """Builds the snapshots of a server, reusing what didn't change.
+
+    The players are only listed again if the players_version of the log
+    changed, the messages are only formatted again if their version
+    changed. The fragments of unchanged sections are taken over from the
+    previous snapshot, so they aren't rendered again.
+
+    """
+
+    def __init__(self, is_running, log, get_messages, get_version=None,
+                 name=None, get_resources=None):
+        """Takes the sources of the info.
+
+        arguments:
+        is_running -- function returning True if the server is running
+        log -- LogParser of the server log
+        get_messages -- function returning the messages, newest first
+        get_version -- function returning the version of the messages,
+                       None to format the messages for each snapshot
+        name -- name of the server, if multiple servers are run
+        get_resources -- function returning the resources used by the
+                         server process, see Snapshot
+
+        """
+        self.is_running = is_running
+        self.log = log
+        self.get_messages = get_messages
+        self.get_version = get_version
+        self.name = name
+        self.get_resources = get_resources
+        self.snapshot = None
+
+    def build(self):
+        """Returns a new Snapshot of the server."""
+        self.log.update()
+
+        online = self.is_running()
+        versions = dict(
+            online=online,
+            players=self.log.players_version,
+            updates=self.get_version() if self.get_version else None,
+        )
+
+        old = self.snapshot
+        if old and old.versions['players'] == versions['players']:
+            players = old.players
+        else:
+            players = self.log.get_playerlist()
+
+        unchanged = versions['updates'] is not None
+        if old and unchanged and old.versions['updates'] == versions['updates']:
+            updates = old.updates
+        else:
+            updates = format_messages(self.get_messages())
+
+        resources = self.get_resources() if self.get_resources else None
+
+        snapshot = Snapshot(
+            online, players, updates, self.name, versions, resources
+        )
+        if old:
+            snapshot.reuse(old)
+
+        self.snapshot = snapshot
+        return snapshot
+
+def build_snapshot(is_running, log, messages, name=None):
+    """Puts the info from the minecraft module together into a Snapshot."""
+
+    log.update()
+
+    updates = format_messages(messages)
+    return Snapshot(is_running(), log.get_playerlist(), updates, name)
+
+def format_messages(messages):
+    """Returns the texts of the messages, prefixed by their dates."""
+    updates = []
+    for msg in messages:
+        datetxt = msg.date.strftime("%d.%m.%Y - %H:%M")
+        updates.append("%s, %s" % (datetxt, msg.text))
+
+    return updates
+
+def render_xml(snapshot):
+    """Returns the XML of the snapshot."""
+
+    if snapshot.server:
+        server = escape(snapshot.server, {'"': '&quot;', '\n': '&#10;'})
+        parts = ['<info server="%s">' % server]
+    else:
+        parts = ['<info>']
+
+    parts.append(snapshot.get_fragment(
+        'online', 'XML', lambda: _render_xml_element('online', snapshot.online)
+    ))
+    parts.append(snapshot.get_fragment(
+        'players', 'XML',
+        lambda: _render_xml_list('players', 'player', snapshot.players)
+    ))
+    parts.append(snapshot.get_fragment(
+        'updates', 'XML',
+        lambda: _render_xml_list('updates', 'update', snapshot.updates)
+    ))
+    if snapshot.resources:
+        parts.append(_render_xml_resources(snapshot.resources))
+    parts.append('</info>')
+
+    return ''.join(parts).encode('ascii', 'xmlcharrefreplace')
+
+def _render_xml_element(tag, value):
+    element = ET.Element(tag)
+    element.text = str(value)
+    return ET.tostring(element)
+
+def _render_xml_list(tag, childtag, texts):
+    element = ET.Element(tag)
+    for text in texts:
+        child = ET.SubElement(element, childtag)
+        child.text = text
+
+    return ET.tostring(element)
+
+def _render_xml_resources(resources):
+    element = ET.Element('resources')
+    for key in RESOURCES:
+        child = ET.SubElement(element, key)
+        child.text = str(resources[key])
+
+    return ET.tostring(element)
+
+def render_json(snapshot):
+    """Returns the JSON of the snapshot."""
+    parts = []
+    for section in ('online', 'players', 'updates'):
+        value = getattr(snapshot, section)
+        fragment = snapshot.get_fragment(
+            section, 'JSON', lambda: json.dumps(value)
+        )
+        parts.append('"%s": %s' % (section, fragment))
+
+    if snapshot.server:
+        parts.append('"server": %s' % json.dumps(snapshot.server))
+    if snapshot.resources:
+        parts.append('"resources": %s' % json.dumps(snapshot.resources))
+
+    return '{%s}' % ', '.join(parts)
+
+def render_binary(snapshot):
+    """Returns the snapshot in the binary format."""
+    flags = FLAG_ONLINE if snapshot.online else 0
+    if snapshot.resources:
+        flags |= FLAG_RESOURCES
+
+    parts = [chr(flags)]
+    parts.append(_pack_string(snapshot.server or ''))
+
+    for section in ('players', 'updates'):
+        strings = getattr(snapshot, section)
+        parts.append(snapshot.get_fragment(
+            section, 'BIN', lambda: _pack_strings(strings)
+        ))
+
+    if snapshot.resources:
+        resources = snapshot.resources
+        parts.append(BINARY_RESOURCES.pack(
+            int(round(resources['cpu'] * 10)), resources['rss'],
+            resources['rss_max'], resources['threads']
+        ))
+
+    body = ''.join(parts)
+    return BINARY_HEADER.pack(BINARY_MAGIC, len(body)) + body
+
+def parse_binary(data):
+    """Returns the info in the binary format as dictionary, with the same
+    keys as the dictionary of Snapshot.to_dict.
+
+    Raises a ValueError if the data is not in the binary format or
+    incomplete.
+
+    """
+    if len(data) < BINARY_HEADER.size:
+        raise ValueError("incomplete data")
+
+    magic, length = BINARY_HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC:
+        raise ValueError("unknown format")
+    if len(data) < BINARY_HEADER.size + length:
+        raise ValueError("incomplete data")
+
+    offset = BINARY_HEADER.size
+    flags = ord(data[offset])
+    info = dict(online=bool(flags & FLAG_ONLINE))
+
+    server, offset = _unpack_string(data, offset + 1)
+    if server:
+        info['server'] = server
+
+    for key in ('players', 'updates'):
+        count, = struct.unpack_from('>H', data, offset)
+        offset += 2
+
+        info[key] = []
+        for i in xrange(count):
+            string, offset = _unpack_string(data, offset)
+            info[key].append(string)
+
+    if flags & FLAG_RESOURCES:
+        values = BINARY_RESOURCES.unpack_from(data, offset)
+        info['resources'] = dict(zip(RESOURCES, values))
+        info['resources']['cpu'] = values[0] / 10.0
+
+    return info
+
+def _pack_string(string):
+    if isinstance(string, unicode):
+        string = string.encode('utf-8')
+    return struct.pack('>H', len(string)) + string
+
+def _pack_strings(strings):
+    """Returns the count of the strings followed by the strings."""
+    parts = [struct.pack('>H', len(strings))]
+    parts.extend(_pack_string(string) for string in strings)
+    return ''.join(parts)
+
+def _unpack_string(data, offset):
+    """Returns the string at the offset and the offset after it."""
+    length, = struct.unpack_from('>H', data, offset)
+    offset += 2
+    return data[offset:offset + length].decode('utf-8'), offset + length
+
+# Renderings of a snapshot by the request token of the clients
+RENDERERS = {
+    'XML': render_xml,
+    'JSON': render_json,
+    'BIN': render_binary,
+}
+
+def diff_snapshots(old, new):
+    """Returns a list of changes turning the old into the new snapshot.
+
+    Each change is a dictionary with a type and a value:
+    online -- the server was started (True) or stopped (False)
+    join -- a player joined
+    leave -- a player left
+    update -- a message was added
+    remove -- a message was removed
+
+    """
+    changes = []
+
+    if old.online != new.online:
+        changes.append(dict(type='online', value=new.online))
+
+    players = set(old.players)
+    changes.extend(
+        dict(type='join', value=p) for p in new.players if p not in players
+    )
+
+    players = set(new.players)
+    changes.extend(
+        dict(type='leave', value=p) for p in old.players if p not in players
+    )
+
+    updates = set(old.updates)
+    changes.extend(
+        dict(type='update', value=u) for u in new.updates if u not in updates
+    )
+
+    updates = set(new.updates)
+    changes.extend(
+        dict(type='remove', value=u) for u in old.updates if u not in updates
+    )
+
+    return changes
@@ -0,0 +1,156 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Waits for changes of a file without blocking the gevent loop.
+
+On Linux inotify is used, so waiting greenlets are only woken up when
+the file is actually written to. Other platforms fall back to polling
+the file in an interval.
+
+"""
+
+import os
+import sys
+import struct
+import ctypes
+import ctypes.util
+
+import gevent
+from gevent import socket
+
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+# wd, mask, cookie, len
+EVENT_HEADER = struct.Struct('iIII')
+
+def _load_inotify():
+    """Returns the libc if it supports inotify, otherwise None."""
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+    return libc
+
+_libc = _load_inotify()
+
+class LogWatcher(object):
+    """Blocks greenlets until the watched file was changed.
+
+    The directory of the file is watched, so a rotated or newly created
+    file is noticed as well.
+
+    """
+
+    def __init__(self, path, interval=1, use_inotify=True):
+        """Starts to watch the given file.
+
+        arguments:
+        path -- file to watch
+        interval -- polling interval in seconds if inotify is not available
+        use_inotify -- set to False to always poll
+
+        """
+        self.path = os.path.abspath(path)
+        self.interval = interval
+        self._fd = None
+
+        if use_inotify and _libc:
+            self._fd = self._add_watch()
+
+        self._stat = self._get_stat()
+
+    @property
+    def uses_inotify(self):
+        return self._fd is not None
+
+    def close(self):
+        """Stops watching the file."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def wait(self, timeout=None):
+        """Waits until the file was changed.
+
+        Returns True if the file changed or False if the timeout was hit.
+
+        """
+        if self._fd is not None:
+            return self._wait_inotify(timeout)
+        else:
+            return self._wait_polling(timeout)
+
+    def _add_watch(self):
+        """Returns an inotify file descriptor watching the directory."""
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+
+        directory = os.path.dirname(self.path)
+        mask = IN_MODIFY | IN_CREATE | IN_MOVED_TO
+        if _libc.inotify_add_watch(fd, directory, mask) < 0:
+            os.close(fd)
+            return None
+
+        return fd
+
+    def _wait_inotify(self, timeout):
+        name = os.path.basename(self.path)
+
+        while True:
+            try:
+                socket.wait_read(self._fd, timeout)
+            except socket.timeout:
+                return False
+
+            try:
+                data = os.read(self._fd, 4096)
+            except OSError:
+                continue
+
+            if name in self._get_names(data):
+                return True
+
+    def _get_names(self, data):
+        """Returns the file names of the inotify events in data."""
+        names = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            names.append(data[offset:offset + length].rstrip('\0'))
+            offset += length
+
+        return names
+
+    def _wait_polling(self, timeout):
+        waited = 0
+        while timeout is None or waited < timeout:
+            gevent.sleep(self.interval)
+            waited += self.interval
+
+            stat = self._get_stat()
+            if stat != self._stat:
+                self._stat = stat
+                return True
+
+        return False
+
+    def _get_stat(self):
+        """Returns the values of the file showing a change."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+
+        return stat.st_ino, stat.st_size, stat.st_mtime
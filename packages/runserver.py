@@ -12,16 +12,24 @@ Entering 'help' after starting the server reveils these commands.
 
 import os
 import threading
-from datetime import datetime
+import traceback
+from datetime import datetime, timedelta
+import multiprocessing
 
 import gevent
-from sqlalchemy import create_engine, desc
+from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from craftinfoserver import generate_xml, EchoServer
-from craftinfo.log import LogParser
+from craftinfoserver import SnapshotBuilder, EchoServer, LogWatcher, Metrics
+from craftinfoserver.prefork import SharedValues, fork_workers, stop_workers
+from craftinfo.log import LogEvents, LogParser, ingest
 from craftinfo.db.tables import Message, create_tables
-from craftinfo.server import is_running
+from craftinfo.db.messages import get_messages, get_revision
+from craftinfo.db.messages import add_message, delete_message
+from craftinfo.db.sessions import SessionRecorder
+from craftinfo.db.activity import ActivityRecorder, get_activity
+from craftinfo.server import DEFAULT_MATCH, ProcessScan, ProcessWatcher
+from craftinfo.server import ResourceSampler
 
 class CommandError(Exception):
     pass
@@ -29,6 +37,175 @@ class CommandError(Exception):
 class StopServer(CommandError):
     pass
 
+class ServerConfig(object):
+    """Definition of a Minecraft server to provide the info of."""
+
+    def __init__(self, name, logfile, port, match=DEFAULT_MATCH,
+                 checkpoint=None, messages=20, pidfile=None,
+                 request_port=None):
+        """Takes the settings of the server.
+
+        arguments:
+        name -- name of the server, tagging the provided info
+        logfile -- path to the server log
+        port -- port on which the info of the server is sent as XML right
+                away, as expected by the clients not sending a request
+        match -- strings of which one is found in the command line of the
+                 server process and not in the ones of other servers
+        checkpoint -- file to save the position in the logfile to, so the
+                      log doesn't have to be read from the start again
+        messages -- number of the newest messages provided, None for all
+        pidfile -- file the server writes its pid to, to find the process
+                   without scanning the process list
+        request_port -- port on which clients request the info as JSON or
+                        in the binary format, subscribe to its changes
+                        or send HTTP requests, None for none
+
+        """
+        self.name = name
+        self.logfile = logfile
+        self.port = port
+        self.match = match
+        self.checkpoint = checkpoint
+        self.messages = messages
+        self.pidfile = pidfile
+        self.request_port = request_port
+
+class Instance(object):
+    """Reads the log and provides the info of one Minecraft server."""
+
+    def __init__(self, config, Session, scan, shared=None, http=False,
+                 metrics=None):
+        """Reads the log of the configured server.
+
+        arguments:
+        config -- ServerConfig of the server
+        Session -- sqlalchemy sessionmaker, sharing the connection pool
+        scan -- ProcessScan shared by all instances
+        shared -- SharedValues to publish the value to, if it is served
+                  by worker processes instead of this process
+        http -- True to answer HTTP requests on the request port
+        metrics -- Metrics registry shared by all instances
+
+        """
+        self.config = config
+        self.Session = Session
+        self.session = Session()
+
+        # record the sessions of the players using a separate session
+        self.recorder = SessionRecorder(Session(), server=config.name)
+        events = LogEvents()
+        events.add(self.recorder)
+
+        # roll up the players online, continuing with the open sessions
+        self.activity = ActivityRecorder(
+            Session(), server=config.name, online=self.recorder.get_open()
+        )
+        events.add(self.activity)
+
+        # if the log has to be read from the start, use all cpus
+        processes = multiprocessing.cpu_count()
+        self.log = LogParser(
+            config.logfile, events, config.checkpoint, processes=processes
+        )
+        self.recorder.flush()
+        self.activity.flush()
+
+        # the process list is only scanned until the process is found
+        self.process = ProcessWatcher(config.match, config.pidfile, scan)
+        self.sampler = ResourceSampler(self.process)
+        self.activity.set_running(self.process.is_running())
+
+        # the messages are only queried again if their revision changed
+        self.builder = SnapshotBuilder(
+            self.process.is_running, self.log,
+            lambda: get_messages(self.session, config.messages),
+            lambda: get_revision(self.session), config.name,
+            self.sampler.get_aggregates
+        )
+        get_value = self.builder.build
+
+        if metrics is None:
+            metrics = Metrics()
+        metrics = metrics.labelled(server=config.name)
+
+        metrics.counter(
+            'craftinfo_log_lines_total', 'Lines read from the log',
+            lambda: self.log.lines
+        )
+        metrics.counter(
+            'craftinfo_log_update_seconds_total',
+            'Seconds spent reading the log', lambda: self.log.update_time
+        )
+
+        if shared:
+            self.srv = EchoServer(
+                None, get_value, share=shared.publish, metrics=metrics
+            )
+        else:
+            self.srv = EchoServer(
+                config.port, get_value, http=http, metrics=metrics,
+                request_port=config.request_port
+            )
+
+        self.watcher = LogWatcher(config.logfile)
+
+    def start(self):
+        self.srv.start()
+
+        # refresh the value as soon as the log is written to
+        gevent.spawn(refresh_on_change, self.watcher, self.srv)
+        gevent.spawn(flush_forever, self.recorder)
+        gevent.spawn(roll_up_forever, self.activity)
+        gevent.spawn(sample_forever, self.sampler)
+
+    def set_recording(self, recording):
+        """Resumes or pauses writing the sessions and activity of the
+        live log, writing what is queued before pausing.
+
+        """
+        if not recording:
+            self.recorder.flush()
+            self.activity.flush()
+
+        self.recorder.paused = not recording
+        self.activity.paused = not recording
+
+    def ingest(self, pattern):
+        """Records the history of the archived logs matching the pattern,
+        returns the files read.
+
+        The archives are recorded by separate recorders, skipping what was
+        recorded before, so the live log isn't affected. Recording the
+        live log should be paused meanwhile, as SQLite databases can't be
+        written by both at once.
+
+        """
+        sessions = SessionRecorder(
+            self.Session(), server=self.config.name, history=True
+        )
+        activity = ActivityRecorder(
+            self.Session(), server=self.config.name, history=True
+        )
+
+        events = LogEvents()
+        events.add(sessions)
+        events.add(activity)
+
+        paths = ingest(pattern, events, exclude=(self.config.logfile, ))
+        sessions.flush()
+        activity.finish()
+
+        return paths
+
+    def stop(self):
+        self.srv.stop()
+        self.watcher.close()
+        self.recorder.flush()
+        self.activity.tick()
+        self.activity.flush()
+        self.log.save_checkpoint()
+
 def wait_for_input(result):
     """Waits for raw_input to return and sends the result to the
     eventlet.event given by parameter.
@@ -37,25 +214,65 @@ def wait_for_input(result):
     line = raw_input()
     result.set(line)
 
-def run_server(logfile, database, port):
-    """Runs the server and listenes to commands."""
+def run_server(servers, database, workers=0, http=False):
+    """Runs the servers and listenes to commands.
+
+    All servers are run by the same gevent loop, sharing the database
+    connections and the scans of the process list.
+
+    If workers are requested, the connections are handled by that many
+    forked processes, sharing the ports. This process then only builds
+    the values and publishes them to the workers through shared memory.
+
+    arguments:
+    servers -- list of ServerConfig instances
+    database -- sqlalchemy url of the database
+    workers -- number of processes handling connections (Linux only)
+    http -- True to answer HTTP requests on the request ports
+
+    """
+
+    # fork the workers before anything else is started, as they would
+    # run it as well
+    shared = dict()
+    if workers:
+        for config in servers:
+            shared[config.name] = SharedValues()
+
+        ports = [
+            (config.port, config.request_port, shared[config.name])
+            for config in servers
+        ]
+        pids = fork_workers(ports, workers, http=http)
+    else:
+        pids = []
 
     engine = create_engine(database)
     create_tables(engine)
 
-    session = sessionmaker(bind=engine)()
+    Session = sessionmaker(bind=engine)
+    scan = ProcessScan()
 
-    log = LogParser(logfile)
+    metrics = Metrics()
+    metrics.counter(
+        'craftinfo_scans_total', 'Scans of the process list',
+        lambda: scan.scans
+    )
+    metrics.counter(
+        'craftinfo_scan_seconds_total', 'Seconds spent scanning processes',
+        lambda: scan.scan_time
+    )
 
-    # definition of callback function
-    def get_value():
-        msgs = session.query(Message).order_by(desc(Message.date))
-        return generate_xml(is_running, log, session, msgs) 
+    instances = [
+        Instance(config, Session, scan, shared.get(config.name), http, metrics)
+        for config in servers
+    ]
+    for instance in instances:
+        instance.start()
 
-    srv = EchoServer(port, get_value)
-    srv.start()
+    gevent.spawn(refresh_on_process_change, instances)
 
-    cmds = Commands(srv, session)
+    cmds = Commands(instances, Session(), metrics)
 
     print 'started'
 
@@ -74,6 +291,60 @@ def run_server(logfile, database, port):
         except StopServer:
             break
 
+    stop_workers(pids)
+
+def refresh_on_change(watcher, srv):
+    """Refreshes the value of the server whenever the watcher notices a
+    change of the logfile.
+
+    """
+    while True:
+        if watcher.wait():
+            srv.invalidate()
+
+def refresh_on_process_change(instances, interval=5):
+    """Refreshes the value of the servers whose process was started or
+    stopped.
+
+    """
+    states = dict()
+    while True:
+        for instance in instances:
+            running = instance.process.is_running()
+            if states.get(instance, running) != running:
+                instance.srv.invalidate()
+                instance.activity.set_running(running)
+            states[instance] = running
+
+        gevent.sleep(interval)
+
+def flush_forever(recorder):
+    """Writes the events queued by the recorder once they are due."""
+    while True:
+        gevent.sleep(recorder.delay)
+        try:
+            recorder.flush_if_due()
+        except Exception:
+            # the events stay queued for the next attempt
+            traceback.print_exc()
+
+def roll_up_forever(activity):
+    """Closes the minutes that passed and writes them once they are due."""
+    while True:
+        gevent.sleep(activity.delay)
+        try:
+            activity.tick()
+            activity.flush_if_due()
+        except Exception:
+            # the minutes stay queued for the next attempt
+            traceback.print_exc()
+
+def sample_forever(sampler, interval=1):
+    """Samples the resources used by the server process in the interval."""
+    while True:
+        sampler.sample()
+        gevent.sleep(interval)
+
 def handle_command(cmds, commandline):
     """Handles the input of the server-commandline, executing commands."""
     cmd = commandline.split(" ")[0].strip()
@@ -98,10 +369,11 @@ class Commands(object):
     function.
 
     """
-    def __init__(self, srv, session):
+    def __init__(self, instances, session, metrics=None):
         """ Initialize the instance with the needed context. """
-        self.srv = srv
+        self.instances = instances
         self.session = session
+        self.metrics = metrics
 
         is_method = lambda attr: callable(getattr(self, attr))
         is_public = lambda attr: not attr.startswith('_')
@@ -125,6 +397,11 @@ class Commands(object):
     def _unknown(self, item):
         print "unknown command"
 
+    def _invalidate(self):
+        """ Causes the servers to update their values. """
+        for instance in self.instances:
+            instance.srv.invalidate()
+
     def help(self, args):
         """ Displays available commands. """
         functions = self._cmds.keys()
@@ -134,22 +411,25 @@ class Commands(object):
 
     def stop(self, args):
         """ Stops the server gracefully. """
-        self.srv.stop()
+        for instance in self.instances:
+            instance.stop()
         raise StopServer
 
     def show(self, args):
         """ Shows log-messages in the console. """
-        self.srv.show_output = True
+        for instance in self.instances:
+            instance.srv.show_output = True
 
     def hide(self, args):
         """ Hides log-messages in the console. """
-        self.srv.show_output = False
+        for instance in self.instances:
+            instance.srv.show_output = False
 
     def add(self, args):
         """ Addes a message with the current time. """
         if args != "":
-            self.session.add(Message(datetime.now(), args))
-            self.session.commit()
+            add_message(self.session, args)
+            self._invalidate()
 
     def list(self, args):
         """ Lists current messages. """
@@ -159,18 +439,63 @@ class Commands(object):
     def delete(self, args):
         """ Removes a message by id. """
         if args != "":
-            msg = self.session.query(Message).filter(Message.uid==args)
-            msg.delete()
-            self.session.commit()
+            delete_message(self.session, args)
+            self._invalidate()
+
+    def ingest(self, args):
+        """ Reads archived logs: ingest <server> <glob or directory>. """
+        name, sep, pattern = args.partition(" ")
+        for instance in self.instances:
+            if instance.config.name == name and pattern.strip():
+                # read by a thread, so the servers keep answering, while
+                # the live log is only queued
+                instance.set_recording(False)
+                try:
+                    threadpool = gevent.get_hub().threadpool
+                    paths = threadpool.apply(
+                        instance.ingest, (pattern.strip(),)
+                    )
+                finally:
+                    instance.set_recording(True)
+
+                instance.srv.invalidate()
+                print "read %i archived logs" % len(paths)
+                return
+
+        print "usage: ingest <server> <glob or directory>"
+
+    def activity(self, args):
+        """ Shows the players online per hour: activity <server> [hours]. """
+        name, sep, hours = args.partition(" ")
+        hours = int(hours) if hours.strip().isdigit() else 24
+
+        end = datetime.now()
+        rows = get_activity(
+            self.session, end - timedelta(hours=hours), end, name, hourly=True
+        )
+        for row in rows:
+            print "%s\t%i max\t%.1f avg\t%i logins\t%is up" % (
+                row.start, row.players_max, row.players_avg, row.logins,
+                row.uptime
+            )
+
+    def stats(self, args):
+        """ Shows the metrics measured since the start. """
+        if self.metrics:
+            for line in self.metrics.get_stats():
+                print line
+
+        for instance in self.instances:
+            log = instance.log
+            rate = log.lines / log.update_time if log.update_time else 0
+            print "%s\t%.0f lines/s" % (instance.config.name, rate)
 
     def value(self, args):
-        """ Shows the current xml value of the server. """
-        print self.srv.value
+        """ Shows the current xml value of the servers. """
+        for instance in self.instances:
+            print "%s\t%s" % (instance.config.name, instance.srv.value)
 
 if __name__=='__main__':
-    #Port to listen to
-    port = 5001
-
     # Database to write updates in
     database = 'sqlite:///db.sqlite'
 
@@ -180,5 +505,21 @@ if __name__=='__main__':
     else:    
         logfile = '/home/denis/minecraft/server.log'
 
-    run_server(logfile, database, port)
-    
+    # Servers to provide the info of, each on its own ports. Add a
+    # ServerConfig for each server run on this host.
+    servers = [
+        ServerConfig(
+            'minecraft', logfile, 5001, checkpoint='log.checkpoint',
+            request_port=5002
+        ),
+    ]
+
+    # Number of processes handling connections, 0 to handle them in this
+    # process. Using more than one requires Linux.
+    workers = 0
+
+    # Answer HTTP requests on the request ports as well, serving the info
+    # as JSON at '/'
+    http = True
+
+    run_server(servers, database, workers, http)
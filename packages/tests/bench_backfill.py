@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks reading a large logfile with a growing number of processes.
+
+Prints the lines per second of LogParser.backfill for each number of
+processes up to the number of cpus, starting with the sequential update.
+
+"""
+
+from __future__ import with_statement
+
+import os
+import sys
+import tempfile
+import multiprocessing
+from time import time
+
+sys.path.append("./../")
+
+from craftinfo.log import LogParser
+from bench_log import generate_lines
+
+
+def measure(path, count, processes):
+    """Returns the lines per second read with the given processes."""
+    start = time()
+    log = LogParser(path, processes=processes)
+    elapsed = time() - start
+    log._stopfollowing()
+
+    return count / elapsed
+
+
+def main(count=2000000):
+    lines = generate_lines(count)
+
+    fd, path = tempfile.mkstemp(suffix='.log')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(lines)
+
+        print "lines:\t\t%i" % count
+        print "size:\t\t%.1f MiB" % (os.path.getsize(path) / 1024.0 ** 2)
+
+        baseline = None
+        for processes in range(1, multiprocessing.cpu_count() + 1):
+            speed = measure(path, count, processes)
+            baseline = baseline or speed
+            print "processes %i:\t%.0f lines/s (%.2fx)" % (
+                processes, speed, speed / baseline
+            )
+    finally:
+        os.remove(path)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
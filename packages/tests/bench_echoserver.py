@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Load-tests the EchoServer with many concurrent clients.
+
+For each payload size, an EchoServer echoing a synthetic value of that
+size is run in a forked process, so the clients don't compete with it
+for the gevent loop. Each of the concurrent clients requests the value
+repeatedly, in each of the modes:
+
+value -- connects to the port and sends nothing, like get_servervalue
+         and the clients older than the request tokens
+token -- sends the token 'XML' to the request port using
+         echoclient.request
+
+Prints the results as JSON, one entry per payload size and mode with the
+requests per second, the latency quantiles in milliseconds and the
+number of errors. Answers of the wrong size count as errors.
+
+usage: bench_echoserver.py [clients] [requests per client] [port]
+
+The request port is the port following the given one.
+
+"""
+
+import os
+import sys
+import json
+import signal
+import resource
+from time import time
+
+import gevent
+from gevent import socket
+
+sys.path.append("./../")
+
+from craftinfoserver import EchoServer, get_servervalue, request
+
+# Sizes of the values in bytes
+PAYLOADS = (64, 4 * 1024, 64 * 1024, 1024 * 1024)
+
+# Functions requesting the value from the port, by mode
+MODES = (
+    ('value', lambda port: get_servervalue("localhost", port)),
+    ('token', lambda port: request("localhost", port + 1, "XML")),
+)
+
+def run_server(port, size, clients):
+    """Forks a process serving a value of the given size, returns its pid
+    once it accepts connections.
+
+    """
+    pid = gevent.fork()
+    if pid == 0:
+        try:
+            value = "x" * size
+            srv = EchoServer(
+                port, lambda: value, interval=None, backlog=clients,
+                max_connections=clients, request_port=port + 1
+            )
+            srv.start()
+            gevent.wait()
+        finally:
+            os._exit(0)
+
+    for i in range(100):
+        try:
+            socket.create_connection(("localhost", port)).close()
+            return pid
+        except socket.error:
+            gevent.sleep(0.05)
+
+    stop_server(pid)
+    raise RuntimeError("server didn't start")
+
+def stop_server(pid):
+    os.kill(pid, signal.SIGTERM)
+    os.waitpid(pid, 0)
+
+def run_client(get_value, port, size, count, latencies, errors):
+    """Requests the value count times, recording the latencies."""
+    for i in range(count):
+        start = time()
+        try:
+            value = get_value(port)
+        except (socket.error, socket.timeout):
+            errors.append(i)
+            continue
+
+        if len(value) != size:
+            errors.append(i)
+        else:
+            latencies.append(time() - start)
+
+def get_quantile(latencies, quantile):
+    """Returns the quantile of the sorted latencies in milliseconds."""
+    if not latencies:
+        return None
+    index = min(len(latencies) - 1, int(quantile * len(latencies)))
+    return round(latencies[index] * 1000, 3)
+
+def measure(port, size, clients, requests):
+    """Returns the results of the clients requesting a value of the size,
+    one for each mode.
+
+    """
+    pid = run_server(port, size, clients)
+    try:
+        return [
+            measure_mode(mode, get_value, port, size, clients, requests)
+            for mode, get_value in MODES
+        ]
+    finally:
+        stop_server(pid)
+
+def measure_mode(mode, get_value, port, size, clients, requests):
+    """Returns the results of the clients requesting in the mode."""
+    latencies = []
+    errors = []
+
+    start = time()
+    gevent.joinall([
+        gevent.spawn(
+            run_client, get_value, port, size, requests, latencies, errors
+        )
+        for i in range(clients)
+    ])
+    elapsed = time() - start
+
+    latencies.sort()
+    return dict(
+        mode=mode,
+        payload=size,
+        clients=clients,
+        requests=clients * requests,
+        seconds=round(elapsed, 3),
+        requests_per_second=round(len(latencies) / elapsed, 1),
+        p50=get_quantile(latencies, 0.5),
+        p99=get_quantile(latencies, 0.99),
+        p999=get_quantile(latencies, 0.999),
+        errors=len(errors),
+    )
+
+def main(clients=2000, requests=10, port=1250):
+    # each client and connection of the server needs a file descriptor
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    results = []
+    for size in PAYLOADS:
+        results.extend(measure(port, size, clients, requests))
+    print json.dumps(results, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,147 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks the classification of log-lines.
+
+Compares the former approach of running a separate search for each kind
+of event with the single pass LineClassifier on a synthetic log and
+prints the lines per second of both.
+
+"""
+
+from __future__ import with_statement
+
+import os
+import re
+import sys
+import random
+import tempfile
+from time import time, strptime
+
+sys.path.append("./../")
+
+from craftinfo.log import LineClassifier, LogFollower, LogParser, parse_date
+
+LINES = (
+    "2010-11-30 20:18:30 [INFO] <user_%i> chit chat about stuff\n",
+    "2010-11-30 20:18:31 [INFO] <user_%i> lost connection, logged in again\n",
+    "2010-11-30 20:00:37 [WARNING] Can't keep up! Did the system time "
+    "change, or is the server overloaded?\n",
+    "2010-11-30 20:00:38 [INFO] user_%i issued server command: list\n",
+    "2010-11-30 20:00:39 [INFO] Saving chunks\n",
+    "2010-11-30 19:56:42 [INFO] user_%i [/188.60.36.18:61540] logged in "
+    "with entity id 24\n",
+    "2010-11-30 20:22:07 [INFO] user_%i lost connection: Quitting\n",
+)
+
+WEIGHTS = (40, 5, 10, 10, 25, 5, 5)
+
+START = "2010-11-30 19:55:15 [INFO] Starting minecraft server version 1.2\n"
+
+
+def generate_lines(count, seed=1):
+    """Returns a list of random log-lines with a realistic mix."""
+    rnd = random.Random(seed)
+    choices = []
+    for line, weight in zip(LINES, WEIGHTS):
+        choices.extend([line] * weight)
+
+    lines = [START]
+    for i in xrange(count - 1):
+        line = rnd.choice(choices)
+        lines.append('%i' in line and line % rnd.randint(0, 50) or line)
+
+    return lines
+
+
+def legacy_classify(line):
+    """The classification as done before the LineClassifier existed."""
+    if '<' in line:
+        return 'chat'
+    if re.search("\[INFO\]\s([a-zA-Z0-9_]*)\s.*logged in", line):
+        return 'login'
+    if re.search("\[INFO\]\s([a-zA-Z0-9_]*)\s.*lost connection", line):
+        return 'logout'
+    if 'Starting' in line:
+        re.search("server version (\S*)", line)
+        return 'start'
+    return None
+
+
+def measure(fn, lines, repeat=3):
+    """Returns the best lines per second of a number of runs."""
+    best = None
+    for i in xrange(repeat):
+        start = time()
+        for line in lines:
+            fn(line)
+        elapsed = time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return len(lines) / best
+
+
+def measure_reading(path, count):
+    """Returns the lines per second read using readline and the
+    LogFollower with its chunks.
+
+    """
+    start = time()
+    with open(path, 'rb') as f:
+        for line in iter(f.readline, ''):
+            pass
+    readline = count / (time() - start)
+
+    start = time()
+    follower = LogFollower(path)
+    for lines in follower.batches():
+        for line in lines:
+            pass
+    follower.close()
+    chunked = count / (time() - start)
+
+    return readline, chunked
+
+
+def measure_parser(lines):
+    """Returns the lines per second of a complete LogParser replay."""
+    fd, path = tempfile.mkstemp(suffix='.log')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(lines)
+
+        readline, chunked = measure_reading(path, len(lines))
+        print "readline:\t%.0f lines/s" % readline
+        print "chunked:\t%.0f lines/s" % chunked
+
+        start = time()
+        LogParser(path)
+        return len(lines) / (time() - start)
+    finally:
+        os.remove(path)
+
+
+def main(count=200000):
+    lines = generate_lines(count)
+
+    legacy = [legacy_classify(line) for line in lines]
+    classify = LineClassifier().classify
+    single = [classify(line)[0] for line in lines]
+    assert legacy == single, "classifications differ"
+
+    before = measure(legacy_classify, lines)
+    after = measure(classify, lines)
+
+    print "lines:\t\t%i" % count
+    print "before:\t\t%.0f lines/s" % before
+    print "after:\t\t%.0f lines/s" % after
+    print "speedup:\t%.2fx" % (after / before)
+    dates = [line[:19] for line in lines]
+    legacy_date = lambda text: strptime(text, "%Y-%m-%d %H:%M:%S")
+    print "strptime:\t%.0f dates/s" % measure(legacy_date, dates)
+    print "parse_date:\t%.0f dates/s" % measure(parse_date, dates)
+
+    print "parser:\t\t%.0f lines/s" % measure_parser(lines)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
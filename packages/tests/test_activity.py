@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.append("./../")
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from craftinfo.db.tables import HourActivity, MinuteActivity, create_tables
+from craftinfo.db.activity import ActivityRecorder, get_activity
+
+def date(hour, minute, second=0):
+    return datetime(2010, 11, 30, hour, minute, second)
+
+class TestActivityRecorder(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        create_tables(engine)
+        self.session = sessionmaker(bind=engine)()
+
+    def get_minutes(self, start=date(0, 0), end=date(23, 59)):
+        return [
+            (m.start, m.players_max, m.player_seconds, m.uptime, m.logins)
+            for m in get_activity(self.session, start, end)
+        ]
+
+    def test_minutes(self):
+        recorder = ActivityRecorder(self.session)
+
+        recorder.on_serverstart('1.0', date(20, 0, 30))
+        recorder.on_playerlogin('notch', date(20, 1, 0))
+        recorder.on_playerlogin('jeb', date(20, 1, 30))
+        recorder.on_playerlogout('notch', date(20, 2, 15))
+        recorder.tick(date(20, 3, 10))
+        recorder.flush()
+
+        self.assertEqual(self.get_minutes(), [
+            (date(20, 0), 0, 0, 30, 0),
+            (date(20, 1), 2, 90, 60, 2),
+            (date(20, 2), 2, 75, 60, 0),
+        ])
+
+        # the server restarted, so nobody is online anymore
+        recorder.on_serverstart('1.0', date(20, 3, 30))
+        recorder.set_running(False, date(20, 4, 0))
+        recorder.tick(date(20, 30, 0))
+        recorder.flush()
+
+        self.assertEqual(self.get_minutes(date(20, 3), date(21, 0)), [
+            (date(20, 3), 1, 30, 60, 0),
+        ])
+
+    def test_hours(self):
+        recorder = ActivityRecorder(self.session, keep=timedelta(hours=1))
+
+        recorder.on_serverstart('1.0', date(20, 30))
+        recorder.on_playerlogin('notch', date(20, 30))
+        recorder.on_playerlogout('notch', date(21, 30))
+        recorder.on_playerlogin('jeb', date(22, 0))
+        recorder.tick(date(23, 0, 10))
+        recorder.flush()
+
+        hours = get_activity(
+            self.session, date(0, 0), date(23, 59), hourly=True
+        )
+        self.assertEqual(
+            [(h.start, h.players_max, h.uptime, h.logins) for h in hours], [
+                (date(20, 0), 1, 1800, 1),
+                (date(21, 0), 1, 3600, 0),
+                (date(22, 0), 1, 3600, 1),
+            ]
+        )
+        self.assertEqual(hours[0].players_avg, 0.5)
+
+        # the minutes older than an hour are deleted
+        minutes = self.get_minutes()
+        self.assertEqual(minutes[0][0], date(22, 0))
+        self.assertEqual(len(minutes), 60)
+
+    def test_reread(self):
+        recorder = ActivityRecorder(self.session, batchsize=1)
+        recorder.on_playerlogin('notch', date(20, 1))
+        recorder.on_playerlogin('jeb', date(20, 2))
+        recorder.tick(date(20, 3, 10))
+
+        # the same events are ignored if the log is read again
+        recorder = ActivityRecorder(
+            self.session, batchsize=1, online=['notch', 'jeb']
+        )
+        recorder.on_playerlogin('notch', date(20, 1))
+        recorder.on_playerlogin('jeb', date(20, 2))
+        recorder.on_playerlogout('jeb', date(20, 3, 30))
+        recorder.tick(date(20, 4, 10))
+
+        # logins don't tell that the server is running
+        self.assertEqual(self.get_minutes(), [
+            (date(20, 1), 1, 60, 0, 1),
+            (date(20, 2), 2, 120, 0, 1),
+            (date(20, 3), 2, 90, 0, 0),
+        ])
+        self.assertEqual(self.session.query(MinuteActivity).count(), 3)
+
+    def test_late(self):
+        recorder = ActivityRecorder(self.session)
+        recorder.on_serverstart('1.0', date(20, 0))
+        recorder.tick(date(20, 1, 15))
+
+        # the login of a lagging log isn't counted in its closed minute,
+        # but the player is online from now on
+        recorder.on_playerlogin('notch', date(20, 0, 58))
+        recorder.tick(date(20, 3, 10))
+        recorder.flush()
+
+        self.assertEqual(self.get_minutes(), [
+            (date(20, 0), 0, 0, 60, 0),
+            (date(20, 1), 1, 55, 60, 0),
+            (date(20, 2), 1, 60, 60, 0),
+        ])
+
+    def test_stop(self):
+        recorder = ActivityRecorder(self.session)
+
+        recorder.on_serverstart('1.0', date(20, 0))
+        recorder.on_playerlogin('notch', date(20, 10))
+        recorder.on_serverstop(date(20, 30))
+
+        # the weeks until the next start are skipped, not counted
+        recorder.set_running(False, date(20, 30) + timedelta(days=30))
+        self.assertEqual(len(recorder._queue), 31)
+        recorder.flush()
+
+        minutes = self.get_minutes()
+        self.assertEqual(sum(m[3] for m in minutes), 1800)
+        self.assertEqual(sum(m[2] for m in minutes), 1200)
+        self.assertEqual(minutes[-1][:4], (date(20, 30), 1, 0, 0))
+    def test_failed_flush(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'db.sqlite')
+        try:
+            engine = create_engine(
+                'sqlite:///' + path, connect_args={'timeout': 0}
+            )
+            create_tables(engine)
+            self.session = sessionmaker(bind=engine)()
+
+            recorder = ActivityRecorder(self.session, batchsize=2)
+            recorder.on_serverstart('1.0', date(20, 58))
+            recorder.on_playerlogin('notch', date(20, 59))
+
+            # closing the minutes and the hour doesn't raise
+            lock = sqlite3.connect(path)
+            lock.execute('BEGIN EXCLUSIVE')
+            recorder.tick(date(21, 0, 30))
+            self.assertRaises(OperationalError, recorder.flush)
+            lock.rollback()
+
+            # the minutes and the hour are kept
+            recorder.flush()
+            self.assertEqual(len(self.get_minutes()), 2)
+            self.assertEqual(self.session.query(HourActivity).count(), 1)
+        finally:
+            self.session.close()
+            shutil.rmtree(directory)
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+import sys
+from time import time
+
+import gevent
+from gevent import socket
+
+sys.path.append("./../")
+
+from craftinfoserver import EchoServer, EchoClient, Snapshot, get_serverxml
+from craftinfoserver import query_servers
+
+class TestEchoClient(unittest.TestCase):
+
+    def test_large_xml(self):
+        players = ['player_%i' % i for i in range(1000)]
+        snapshot = Snapshot(True, players, [])
+        srv = EchoServer(None, lambda: snapshot, interval=None,
+                         request_port=1242)
+        srv.start()
+
+        self.assertEqual(get_serverxml("localhost", 1242), srv.value)
+        srv.stop()
+
+    def test_shared_fetch(self):
+        snapshot = Snapshot(True, ['notch'], [])
+        srv = EchoServer(None, lambda: snapshot, interval=None,
+                         request_port=1243)
+        srv.start()
+
+        client = EchoClient("localhost", 1243, ttl=60)
+        fetches = [gevent.spawn(client.get_info) for i in range(10)]
+        gevent.joinall(fetches, timeout=5)
+
+        for fetch in fetches:
+            self.assertEqual(fetch.value, snapshot.to_dict())
+
+        # cached info is returned without asking the server
+        client.get_info()
+        self.assertEqual(srv._accepted.get(), 1)
+        srv.stop()
+
+    def test_persistent(self):
+        state = dict(players=['notch'])
+        get_snapshot = lambda: Snapshot(True, state['players'], [])
+
+        srv = EchoServer(None, get_snapshot, interval=None, coalesce=0,
+                         http=True, keepalive=0.2, request_port=1244)
+        srv.start()
+
+        client = EchoClient("localhost", 1244, ttl=0, persistent=True)
+        for i in range(3):
+            self.assertEqual(client.get_info()['players'], ['notch'])
+        self.assertEqual(srv._accepted.get(), 1)
+
+        state['players'] = ['jeb']
+        srv.invalidate()
+        gevent.sleep(0.1)
+        self.assertEqual(client.get_info()['players'], ['jeb'])
+
+        # the connection closed by the server is opened again
+        gevent.sleep(0.4)
+        self.assertEqual(client.get_info()['players'], ['jeb'])
+        self.assertEqual(srv._accepted.get(), 2)
+
+        client.close()
+        srv.stop()
+
+class TestQueryServers(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = []
+        for port in (1245, 1246):
+            snapshot = Snapshot(True, ['player_%i' % port], [])
+            srv = EchoServer(None, lambda s=snapshot: s, interval=None,
+                             request_port=port)
+            srv.start()
+            self.servers.append(srv)
+
+        # accepts connections but never answers
+        self.silent = socket.socket()
+        self.silent.bind(('localhost', 1247))
+        self.silent.listen(5)
+
+    def tearDown(self):
+        for srv in self.servers:
+            srv.stop()
+        self.silent.close()
+
+    def test_partial_results(self):
+        targets = [("localhost", 1245), ("localhost", 1246),
+                   ("localhost", 1247), ("localhost", 1248)]
+
+        start = time()
+        infos, errors = query_servers(targets, timeout=0.5)
+        self.assertTrue(time() - start < 1)
+
+        self.assertEqual(infos[("localhost", 1245)]['players'], ['player_1245'])
+        self.assertEqual(infos[("localhost", 1246)]['players'], ['player_1246'])
+
+        self.assertEqual(set(errors), set(targets[2:]))
+        self.assertTrue(isinstance(errors[("localhost", 1247)], socket.timeout))
+        self.assertTrue(isinstance(errors[("localhost", 1248)], socket.error))
+
+    def test_deadline(self):
+        targets = [("localhost", 1245), ("localhost", 1247)]
+
+        start = time()
+        infos, errors = query_servers(targets, timeout=10, deadline=0.3)
+        self.assertTrue(time() - start < 1)
+
+        self.assertEqual(list(infos), [("localhost", 1245)])
+        self.assertEqual(list(errors), [("localhost", 1247)])
+
+if __name__=="__main__":
+    unittest.main()
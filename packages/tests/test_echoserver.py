@@ -3,21 +3,28 @@
 
 import unittest
 import sys
+import json
+from time import time
+
 import gevent
+from gevent import socket
 
 sys.path.append("./../")
 
-from craftinfoserver import EchoServer, get_servervalue
+from craftinfoserver import EchoServer, Snapshot, get_servervalue, subscribe
+from craftinfoserver import get_serverinfo, get_serverjson, get_serverxml
+from craftinfoserver import request
 
 class TestServer(unittest.TestCase):
 
     def test_server(self):
         get_result = lambda: "deadbeef"
-        srv = EchoServer(1234, get_result)
+        srv = EchoServer(1234, get_result, request_port=1334)
         srv.start()
 
         direct_result = get_result()
 
+        start = time()
         request = gevent.spawn(get_servervalue, "localhost", 1234)
         while not request.ready():
             gevent.sleep(0)
@@ -26,5 +33,202 @@ class TestServer(unittest.TestCase):
 
         self.assertEqual(direct_result, request_result)
 
+        # clients sending nothing don't wait for the negotiation timeout
+        self.assertTrue(time() - start < srv.negotiate)
+        srv.stop()
+
+    def test_invalidate(self):
+        calls = []
+        def get_result():
+            calls.append(True)
+            return u"calls: %i" % len(calls)
+
+        srv = EchoServer(1235, get_result, interval=None, coalesce=0.1)
+        srv.start()
+        self.assertEqual(srv.value, "calls: 1")
+        self.assertTrue(isinstance(srv.value, str))
+
+        # invalidations within the window result in one call
+        for i in range(10):
+            srv.invalidate()
+        gevent.sleep(0.3)
+        self.assertEqual(len(calls), 2)
+
+        # no calls without invalidation
+        gevent.sleep(0.3)
+        self.assertEqual(len(calls), 2)
+
+        self.assertEqual(get_servervalue("localhost", 1235), "calls: 2")
+        srv.stop()
+
+    def test_failing_callback(self):
+        results = ["v1", RuntimeError("database is locked"), "v3"]
+        def get_result():
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        srv = EchoServer(None, get_result, interval=None, coalesce=0)
+        srv.start()
+
+        # the last value is kept, and later invalidations still work
+        srv.invalidate()
+        gevent.sleep(0.1)
+        self.assertEqual(srv.value, "v1")
+
+        srv.invalidate()
+        gevent.sleep(0.1)
+        self.assertEqual(srv.value, "v3")
+        self.assertFalse(srv._cacheloop.dead)
+        srv.stop()
+
+    def test_renderings(self):
+        snapshot = Snapshot(True, ['notch'], ['update'])
+        srv = EchoServer(1237, lambda: snapshot, interval=None,
+                         request_port=1337)
+        srv.start()
+
+        info = snapshot.to_dict()
+        self.assertEqual(get_serverinfo("localhost", 1337), info)
+        self.assertEqual(get_serverjson("localhost", 1337), info)
+        self.assertTrue(get_serverxml("localhost", 1337).startswith("<info>"))
+
+        # clients sending nothing, or an empty token, get the xml
+        self.assertEqual(get_servervalue("localhost", 1237), srv.value)
+        self.assertEqual(request("localhost", 1337, ""), srv.value)
+
+        # the port sends the xml to clients sending a token anyway
+        self.assertEqual(get_serverinfo("localhost", 1237), info)
+
+        srv.stop()
+
+    def test_large_value(self):
+        value = "x" * 4 * 1024 * 1024
+        srv = EchoServer(1238, lambda: value, interval=None)
+        srv.start()
+
+        clients = [
+            gevent.spawn(get_servervalue, "localhost", 1238) for i in range(5)
+        ]
+        gevent.joinall(clients, timeout=10)
+
+        for client in clients:
+            self.assertEqual(len(client.value), len(value))
+
+        srv.stop()
+
+    def test_subscribe(self):
+        state = dict(players=['notch'])
+        get_snapshot = lambda: Snapshot(True, state['players'], [])
+
+        srv = EchoServer(None, get_snapshot, interval=None, coalesce=0,
+                         request_port=1236)
+        srv.start()
+
+        received = []
+        def receive(seq=None, count=2):
+            for change in subscribe("localhost", 1236, seq):
+                received.append(change)
+                if len(received) == count:
+                    break
+
+        client = gevent.spawn(receive)
+        gevent.sleep(0.1)
+
+        state['players'] = ['notch', 'jeb']
+        srv.invalidate()
+        client.join(1)
+
+        self.assertEqual(received, [
+            dict(type='snapshot', seq=0, value=dict(
+                online=True, players=['notch'], updates=[]
+            )),
+            dict(type='join', seq=1, value='jeb'),
+        ])
+
+        # resubscribing with the last sequence number sends the changes
+        state['players'] = ['jeb']
+        srv.invalidate()
+        gevent.sleep(0.1)
+
+        del received[:]
+        gevent.spawn(receive, 1, 1).join(1)
+        self.assertEqual(received, [dict(type='leave', seq=2, value='notch')])
+
+        srv.stop()
+
+    def test_http(self):
+        state = dict(players=['notch'])
+        get_snapshot = lambda: Snapshot(True, state['players'], [])
+
+        srv = EchoServer(None, get_snapshot, interval=None, coalesce=0,
+                         http=True, request_port=1239)
+        srv.start()
+
+        c = socket.create_connection(("localhost", 1239))
+        reader = c.makefile('rb')
+
+        def get(headers=''):
+            c.sendall("GET / HTTP/1.1\r\nHost: localhost\r\n%s\r\n" % headers)
+            status = reader.readline().split()[1]
+            headers = dict()
+            for line in iter(reader.readline, '\r\n'):
+                name, value = line.split(':', 1)
+                headers[name.lower()] = value.strip()
+
+            body = reader.read(int(headers.get('content-length', 0)))
+            return status, headers, body
+
+        # both requests are answered on the same connection
+        status, headers, body = get()
+        self.assertEqual(status, '200')
+        self.assertEqual(json.loads(body), srv.snapshot.to_dict())
+
+        etag = headers['etag']
+        status, headers, body = get('If-None-Match: %s\r\n' % etag)
+        self.assertEqual(status, '304')
+        self.assertEqual(body, '')
+
+        # the etag changes with the value
+        state['players'] = ['jeb']
+        srv.invalidate()
+        gevent.sleep(0.1)
+
+        status, headers, body = get('If-None-Match: %s\r\n' % etag)
+        self.assertEqual(status, '200')
+        self.assertNotEqual(headers['etag'], etag)
+        self.assertEqual(json.loads(body)['players'], ['jeb'])
+
+        c.close()
+        srv.stop()
+
+    def test_etag_restart(self):
+        def get_etag(players):
+            snapshot = Snapshot(True, players, [])
+            srv = EchoServer(None, lambda: snapshot, interval=None)
+            srv.start()
+            srv.stop()
+            return srv._get_etag('JSON', *srv._read_value('JSON'))
+
+        # the generations restart with the process, the etags don't match
+        self.assertNotEqual(get_etag(['notch']), get_etag(['jeb']))
+        self.assertEqual(get_etag(['notch']), get_etag(['notch']))
+
+    def test_metrics(self):
+        srv = EchoServer(None, lambda: "deadbeef", interval=None,
+                         request_port=1241)
+        srv.start()
+
+        for i in range(3):
+            self.assertEqual(request("localhost", 1241, "XML"), "deadbeef")
+
+        text = request("localhost", 1241, "METRICS")
+        self.assertTrue('craftinfo_connections_total 4' in text)
+        self.assertTrue('craftinfo_sent_bytes_total 24' in text)
+        self.assertTrue('craftinfo_response_seconds_count 3' in text)
+        self.assertTrue('craftinfo_rebuild_seconds_count 1' in text)
+        srv.stop()
+
 if __name__=="__main__":
     unittest.main()
\ No newline at end of file
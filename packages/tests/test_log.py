@@ -9,11 +9,23 @@ from __future__ import with_statement
 
 import os
 import sys
+import gzip
+import shutil
+import tempfile
 import unittest
+from datetime import datetime
 
 sys.path.append("./../")
 
-from craftinfo.log import LogEvents, LogParser
+import craftinfo.log
+from craftinfo.log import LineClassifier, LogEvents, LogFollower, LogParser
+from craftinfo.log import ingest, parse_date
+from craftinfo.db.tables import Session as Session_, create_tables
+from craftinfo.db.sessions import SessionRecorder
+from craftinfo.db.activity import ActivityRecorder, get_activity
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
 
 LOGLINES = (
     "2010-11-30 19:55:15 [INFO] Starting craftinfo server version 0.2.6_02\n",
@@ -32,8 +44,12 @@ MORELINES = (
     "2010-11-30 20:22:07 [INFO] user_test [/123.123.123.12:12345] lost connection\n"  
 )
 
+STOPLINE = "2010-11-30 20:30:00 [INFO] Stopping server\n"
+
 LOGFILE = "generated.log"
 
+CHECKPOINT = "generated.checkpoint"
+
 
 def generatelog():
     with open(LOGFILE, "w") as f:
@@ -63,6 +79,7 @@ class TestLogParser(unittest.TestCase):
         events.on_playerlogin = self.onlogin
         log = LogParser(LOGFILE, events)
         self.assertEqual(self.logins, 2)
+        self.assertEqual(log._starttime, datetime(2010, 11, 30, 19, 55, 15))
         self.assertEqual(log.version, '0.2.6_02')
 
         players = log.get_playerlist()
@@ -81,6 +98,17 @@ class TestLogParser(unittest.TestCase):
         players = log.get_playerlist()
         self.assertEqual(len(players), 0)
 
+        #the players are disconnected when the server stops
+        with open(LOGFILE, "a+") as f:
+            f.write(LOGLINES[2])
+        log.update()
+        self.assertEqual(len(log.get_playerlist()), 1)
+
+        with open(LOGFILE, "a+") as f:
+            f.write(STOPLINE)
+        log.update()
+        self.assertEqual(len(log.get_playerlist()), 0)
+
         #removing the logfile has to fail as info still has the handle
         #(apparently only windows raises an error)
         if os.name == 'nt':
@@ -91,5 +119,295 @@ class TestLogParser(unittest.TestCase):
         #shouldn't throw an exception anymore
         removelog()
 
+class TestLogEvents(unittest.TestCase):
+
+    def test_add(self):
+        calls = []
+
+        class Listener(object):
+            def on_playerlogin(self, player, date):
+                calls.append(('listener', player))
+
+        events = LogEvents()
+        events.on_playerlogin = lambda player, date: calls.append(('set', player))
+        events.add(Listener())
+
+        events.on_playerlogin('user_test', None)
+        events.on_playerlogout('user_test', None)
+        self.assertEqual(calls, [('set', 'user_test'), ('listener', 'user_test')])
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        generatelog()
+
+    def tearDown(self):
+        for path in (LOGFILE, CHECKPOINT):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def onlogin(self, player, time):
+        self.logins += 1
+
+    def test_restore(self):
+        log = LogParser(LOGFILE, checkpoint=CHECKPOINT)
+        log.save_checkpoint()
+        del log
+
+        appendlog()
+
+        events = LogEvents()
+        self.logins = 0
+        events.on_playerlogin = self.onlogin
+
+        log = LogParser(LOGFILE, events, checkpoint=CHECKPOINT)
+
+        # only the appended lines were read
+        self.assertEqual(self.logins, 0)
+        self.assertEqual(log.version, '0.2.6_02')
+        self.assertEqual(log.get_playerlist(), [])
+        self.assertEqual(log.follower.offset, os.path.getsize(LOGFILE))
+        del log
+
+    def test_changed_log(self):
+        log = LogParser(LOGFILE, checkpoint=CHECKPOINT)
+        log.save_checkpoint()
+        del log
+
+        # a different log of the same size must not be resumed
+        with open(LOGFILE, "r+") as f:
+            f.write("2011")
+
+        log = LogParser(LOGFILE, checkpoint=CHECKPOINT)
+        self.assertFalse(log.restore_checkpoint())
+        self.assertEqual(log.get_playerlist(), ['user_test'])
+        del log
+
+class TestRotation(unittest.TestCase):
+
+    def setUp(self):
+        generatelog()
+
+    def tearDown(self):
+        for path in (LOGFILE, LOGFILE + '.1'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_rotated(self):
+        log = LogParser(LOGFILE)
+        self.assertEqual(log.get_playerlist(), ['user_test'])
+
+        # the server writes to the rotated file before reopening the log
+        os.rename(LOGFILE, LOGFILE + '.1')
+        with open(LOGFILE + '.1', "a") as f:
+            f.writelines(MORELINES)
+        with open(LOGFILE, "w") as f:
+            f.write(LOGLINES[2].replace('user_test', 'newuser'))
+
+        log.update()
+        self.assertEqual(log.get_playerlist(), ['newuser'])
+        self.assertEqual(log.follower.offset, os.path.getsize(LOGFILE))
+        del log
+
+    def test_truncated(self):
+        log = LogParser(LOGFILE)
+
+        with open(LOGFILE, "w") as f:
+            f.write(MORELINES[-1])
+
+        log.update()
+        self.assertEqual(log.get_playerlist(), [])
+        self.assertEqual(log.follower.offset, os.path.getsize(LOGFILE))
+        del log
+
+class TestLogFollower(unittest.TestCase):
+
+    def tearDown(self):
+        removelog()
+
+    def test_partial_lines(self):
+        with open(LOGFILE, "w") as f:
+            f.write(LOGLINES[0] + LOGLINES[1][:10])
+
+        # chunks smaller than the lines have to be joined
+        follower = LogFollower(LOGFILE, chunksize=16)
+        self.assertEqual(list(follower), [LOGLINES[0]])
+        self.assertEqual(follower.offset, len(LOGLINES[0]))
+
+        with open(LOGFILE, "a") as f:
+            f.write(LOGLINES[1][10:] + LOGLINES[2])
+
+        self.assertEqual(list(follower), [LOGLINES[1], LOGLINES[2]])
+        self.assertEqual(follower.offset, os.path.getsize(LOGFILE))
+        follower.close()
+
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        self.minsize = craftinfo.log.BACKFILL_MINSIZE
+        craftinfo.log.BACKFILL_MINSIZE = 0
+
+        with open(LOGFILE, "w") as f:
+            for i in range(500):
+                for line in LOGLINES + MORELINES:
+                    f.write(line.replace('user_test', 'user_%i' % (i % 7)))
+
+            # not terminated yet, left to the follower
+            f.write(LOGLINES[2][:20])
+
+    def tearDown(self):
+        craftinfo.log.BACKFILL_MINSIZE = self.minsize
+        removelog()
+
+    def get_events(self):
+        events = LogEvents()
+        self.events = []
+
+        def record(name):
+            return lambda *args: self.events.append((name, ) + args)
+
+        events.on_playerlogin = record('login')
+        events.on_playerlogout = record('logout')
+        events.on_serverstart = record('start')
+        events.on_serverstop = record('stop')
+
+        return events
+
+    def test_backfill(self):
+        sequential = LogParser(LOGFILE, self.get_events())
+        expected = self.events
+
+        parallel = LogParser(LOGFILE, self.get_events(), processes=3)
+
+        self.assertEqual(self.events, expected)
+        self.assertEqual(parallel.get_players(), sequential.get_players())
+        self.assertEqual(parallel.version, sequential.version)
+        self.assertEqual(parallel._starttime, sequential._starttime)
+        self.assertEqual(parallel.follower.offset, sequential.follower.offset)
+
+        del sequential
+        del parallel
+
+class TestParseDate(unittest.TestCase):
+
+    def test_parse_date(self):
+        date = parse_date(LOGLINES[0][:19])
+        self.assertEqual(date, datetime(2010, 11, 30, 19, 55, 15))
+        self.assertTrue(parse_date(LOGLINES[0][:19]) is date)
+
+        self.assertRaises(ValueError, parse_date, "2010-11-30 xx:55:15")
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.archive = tempfile.mkdtemp()
+
+        # named against the order of their dates
+        with gzip.open(os.path.join(self.archive, 'b.log.gz'), "wb") as f:
+            f.writelines(LOGLINES)
+        with open(os.path.join(self.archive, 'a.log'), "w") as f:
+            f.write(MORELINES[-1].replace('2010-11-30', '2010-12-01'))
+
+        with open(LOGFILE, "w") as f:
+            f.write(LOGLINES[2].replace('2010-11-30', '2010-12-02'))
+
+    def tearDown(self):
+        shutil.rmtree(self.archive)
+        removelog()
+
+    def test_ingest(self):
+        live = LogEvents()
+        self.live = []
+        live.on_playerlogin = lambda p, d: self.live.append(('in', d.day))
+
+        events = LogEvents()
+        self.events = []
+        events.on_playerlogin = lambda p, d: self.events.append(('in', d.day))
+        events.on_playerlogout = lambda p, d: self.events.append(('out', d.day))
+
+        log = LogParser(LOGFILE, live)
+
+        paths = ingest(self.archive, events, exclude=(LOGFILE, ))
+        self.assertEqual(
+            [os.path.basename(path) for path in paths], ['b.log.gz', 'a.log']
+        )
+
+        self.assertEqual(
+            self.events, [('in', 30), ('in', 30), ('out', 1)]
+        )
+
+        # the state and events of the logfile don't see the archives
+        self.assertEqual(self.live, [('in', 2)])
+        self.assertEqual(log.get_playerlist(), ['user_test'])
+        self.assertEqual(log.version, None)
+        del log
+
+    def ingest_history(self, Session):
+        sessions = SessionRecorder(Session(), history=True)
+        activity = ActivityRecorder(Session(), history=True)
+
+        events = LogEvents()
+        events.add(sessions)
+        events.add(activity)
+
+        ingest(self.archive, events, exclude=(LOGFILE, ))
+        sessions.flush()
+        activity.finish()
+
+    def test_ingest_history(self):
+        engine = create_engine('sqlite://')
+        create_tables(engine)
+        Session = sessionmaker(bind=engine)
+
+        events = LogEvents()
+        events.add(SessionRecorder(Session(), batchsize=1))
+        log = LogParser(LOGFILE, events)
+
+        # reading the archives again doesn't record them twice
+        self.ingest_history(Session)
+        self.ingest_history(Session)
+
+        session = Session()
+        query = session.query(Session_).order_by(Session_.login)
+        self.assertEqual(
+            [(s.login.day, s.logout and s.logout.day) for s in query],
+            [(30, 1), (2, None)]
+        )
+
+        hours = get_activity(
+            session, datetime(2010, 11, 30), datetime(2010, 12, 2),
+            hourly=True
+        )
+        self.assertEqual(hours[0].start, datetime(2010, 11, 30, 19))
+        self.assertEqual(hours[0].uptime, 285)
+        self.assertEqual(hours[1].uptime, 3600)
+        del log
+
+class TestLineClassifier(unittest.TestCase):
+
+    def test_classify(self):
+        classify = LineClassifier().classify
+        kinds = [classify(line)[0] for line in LOGLINES + MORELINES]
+        self.assertEqual(kinds, [
+            'start', 'chat', 'login', 'login', 'logout', None, None,
+            None, None, None, 'logout'
+        ])
+        self.assertEqual(classify(STOPLINE)[0], 'stop')
+
+        kind, match = classify(LOGLINES[0])
+        self.assertEqual(match.group('version'), '0.2.6_02')
+
+        kind, match = classify(LOGLINES[2])
+        self.assertEqual(match.group('login_player'), 'user_test')
+
+    def test_register(self):
+        classifier = LineClassifier()
+        classifier.register('lag', r"Can't keep up!")
+        self.assertEqual(classifier.classify(MORELINES[2])[0], 'lag')
+        self.assertEqual(classifier.classify(LOGLINES[2])[0], 'login')
+
+        self.assertRaises(ValueError, classifier.register, 'lag', 'lag')
+        self.assertRaises(ValueError, classifier.register, 'chat', 'chat')
+
 if __name__=="__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.append("./../")
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+
+from craftinfo.db.tables import Message, create_tables
+from craftinfo.db.messages import get_messages, get_revision
+from craftinfo.db.messages import add_message, delete_message
+
+class TestMessages(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        create_tables(self.engine)
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+        self.reader = Session()
+
+    def test_revision(self):
+        self.assertEqual(get_revision(self.reader), 0)
+
+        for day in range(1, 6):
+            add_message(self.session, 'day %i' % day, datetime(2010, 11, day))
+        self.assertEqual(get_revision(self.reader), 5)
+
+        texts = [m.text for m in get_messages(self.reader, 2)]
+        self.assertEqual(texts, ['day 5', 'day 4'])
+
+        uid = get_messages(self.reader, 1)[0].uid
+        self.assertTrue(delete_message(self.session, uid))
+        self.assertEqual(get_revision(self.reader), 6)
+
+        # nothing deleted, nothing changed
+        self.assertFalse(delete_message(self.session, uid))
+        self.assertEqual(get_revision(self.reader), 6)
+
+        texts = [m.text for m in get_messages(self.reader)]
+        self.assertEqual(texts, ['day 4', 'day 3', 'day 2', 'day 1'])
+
+    def test_missing_index(self):
+        index = list(Message.__table__.indexes)[0]
+        index.drop(self.engine)
+
+        create_tables(self.engine)
+        indexes = inspect(self.engine).get_indexes('messages')
+        self.assertEqual([i['column_names'] for i in indexes], [['date']])
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+import sys
+
+sys.path.append("./../")
+
+from craftinfoserver.metrics import Metrics, Histogram
+
+class TestHistogram(unittest.TestCase):
+
+    def test_quantiles(self):
+        histogram = Histogram((1, 2, 5))
+        self.assertEqual(histogram.get_quantile(0.5), None)
+
+        for value in (0.5, 1, 1.5, 3, 10):
+            histogram.observe(value)
+
+        # values equal to a bound belong to its bucket
+        self.assertEqual(histogram.counts, [2, 1, 1, 1])
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.sum, 16)
+
+        self.assertEqual(histogram.get_quantile(0.4), 1)
+        self.assertEqual(histogram.get_quantile(0.6), 2)
+        self.assertEqual(histogram.get_quantile(1), float('inf'))
+
+class TestMetrics(unittest.TestCase):
+
+    def test_labelled(self):
+        metrics = Metrics()
+        a = metrics.labelled(server='a').counter('requests', 'Requests')
+        b = metrics.labelled(server='b').counter('requests', 'Requests')
+
+        a.inc()
+        b.inc(2)
+
+        self.assertTrue(a is metrics.labelled(server='a').counter('requests', ''))
+        self.assertRaises(ValueError, metrics.gauge, 'requests', 'Requests')
+
+        self.assertEqual(metrics.render(), "\n".join([
+            '# HELP requests Requests',
+            '# TYPE requests counter',
+            'requests{server="a"} 1',
+            'requests{server="b"} 2',
+        ]) + "\n")
+
+    def test_render(self):
+        metrics = Metrics()
+        metrics.gauge('open', 'Open', lambda: 3)
+        histogram = metrics.histogram('seconds', 'Seconds', (0.1, 1))
+        histogram.observe(0.5)
+
+        self.assertEqual(metrics.render(), "\n".join([
+            '# HELP open Open',
+            '# TYPE open gauge',
+            'open 3',
+            '# HELP seconds Seconds',
+            '# TYPE seconds histogram',
+            'seconds_bucket{le="0.1"} 0',
+            'seconds_bucket{le="1"} 1',
+            'seconds_bucket{le="+Inf"} 1',
+            'seconds_sum 0.5',
+            'seconds_count 1',
+        ]) + "\n")
+
+        self.assertEqual(metrics.get_stats(), [
+            "open\t3",
+            "seconds\tcount 1, mean 0.5000, p50 1, p99 1, p999 1",
+        ])
+
+if __name__=="__main__":
+    unittest.main()
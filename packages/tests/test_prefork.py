@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import sys
+import unittest
+import gevent
+from gevent import socket
+
+sys.path.append("./../")
+
+from craftinfoserver import request, get_servervalue
+from craftinfoserver.prefork import SharedValues, WorkerServer
+from craftinfoserver.prefork import fork_workers, stop_workers
+
+class TestSharedValues(unittest.TestCase):
+
+    def test_publish(self):
+        shared = SharedValues(slotsize=1024, slots=2)
+        self.assertEqual(shared.get(), None)
+
+        shared.publish(dict(JSON='{}'), '<info />')
+        self.assertEqual(str(shared.get('JSON')), '{}')
+        self.assertEqual(str(shared.get()), '<info />')
+        self.assertEqual(str(shared.get('BIN')), '<info />')
+
+        for i in range(3):
+            shared.publish(dict(), 'value %i' % i)
+        self.assertEqual(str(shared.get()), 'value 2')
+        self.assertEqual(shared.get_generation(), 4)
+
+        self.assertRaises(ValueError, shared.publish, dict(), 'x' * 1024)
+
+    def test_reused(self):
+        shared = SharedValues(slotsize=1024, slots=3)
+        shared.publish(dict(), 'value 1')
+
+        generation, value = shared.read()
+        shared.publish(dict(), 'value 2')
+        self.assertFalse(shared.is_reused(generation))
+
+        # the next publication writes to the slot of the value
+        shared.publish(dict(), 'value 3')
+        self.assertTrue(shared.is_reused(generation))
+
+class TestWorkers(unittest.TestCase):
+
+    def test_workers(self):
+        if not sys.platform.startswith('linux'):
+            return
+
+        shared = SharedValues()
+        shared.publish(dict(JSON='{"online": true}'), 'x' * 1024 * 1024)
+
+        pids = fork_workers([(1240, 1340, shared)], 2)
+        try:
+            gevent.sleep(0.5)
+
+            value = get_servervalue("localhost", 1240)
+            self.assertEqual(len(value), 1024 * 1024)
+            self.assertEqual(
+                request("localhost", 1340, "JSON"), '{"online": true}'
+            )
+
+            # published values are sent by the workers right away
+            shared.publish(dict(), '<info />')
+            for i in range(4):
+                self.assertEqual(get_servervalue("localhost", 1240), '<info />')
+        finally:
+            stop_workers(pids)
+
+    def test_overwritten_while_sending(self):
+        size = 8 * 1024 * 1024
+        shared = SharedValues(slotsize=size + 1024, slots=2)
+        shared.publish(dict(), 'x' * size)
+
+        worker = WorkerServer(1349, None, shared)
+        worker.start()
+        try:
+            # a slow client keeps the worker sending the value
+            c = socket.socket()
+            c.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            c.connect(("localhost", 1349))
+            gevent.sleep(0.1)
+
+            shared.publish(dict(), 'y' * size)
+            shared.publish(dict(), 'z' * size)
+
+            # the connection is reset instead of ending the mixed data
+            def read_all():
+                while c.recv(65536):
+                    pass
+            self.assertRaises(socket.error, read_all)
+            c.close()
+        finally:
+            for server in worker.servers:
+                server.stop()
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import tempfile
+import unittest
+import subprocess
+
+sys.path.append("./../")
+
+import craftinfo.server
+from craftinfo.server import ProcessScan, ProcessWatcher, ResourceSampler
+from craftinfo.server import is_running
+from craftinfo.proc import get_cmdline, get_starttime
+
+PROCS = [
+    "/sbin/init\0",
+    "java\0-jar\0/srv/survival/minecraft_server.jar\0nogui\0",
+    "java\0-jar\0/srv/creative/craftbukkit.jar\0",
+]
+
+class TestIsRunning(unittest.TestCase):
+
+    def test_match(self):
+        if os.name == 'nt':
+            return
+
+        self.assertTrue(is_running(procs=PROCS))
+        self.assertTrue(is_running(('/srv/creative/', ), PROCS))
+        self.assertFalse(is_running(('/srv/hardcore/', ), PROCS))
+
+    def test_shared_scan(self):
+        if os.name == 'nt':
+            return
+
+        scans = []
+        def get_proclist():
+            scans.append(True)
+            return PROCS
+
+        original = craftinfo.server.get_proclist
+        craftinfo.server.get_proclist = get_proclist
+        try:
+            scan = ProcessScan(maxage=60)
+            self.assertTrue(scan.is_running(('/srv/survival/', )))
+            self.assertTrue(scan.is_running(('/srv/creative/', )))
+            self.assertEqual(len(scans), 1)
+        finally:
+            craftinfo.server.get_proclist = original
+
+class TestProcessWatcher(unittest.TestCase):
+
+    def setUp(self):
+        # unique, so no other process matches, like a shell running tests
+        self.marker = 'craftinfo-test-server-%i' % os.getpid()
+        self.process = subprocess.Popen([
+            sys.executable, '-c', 'import time; time.sleep(30)',
+            self.marker
+        ])
+
+        # until the child executed python, it has the command line of
+        # the test
+        for i in range(100):
+            cmdline = get_cmdline(self.process.pid) or ''
+            if self.marker in cmdline:
+                break
+            time.sleep(0.01)
+
+    def tearDown(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def test_scan_once(self):
+        if not os.path.isdir('/proc'):
+            return
+
+        scan = ProcessScan(maxage=0)
+        watcher = ProcessWatcher((self.marker, ), scan=scan,
+                                 interval=0)
+
+        self.assertEqual(watcher.get_pid(), self.process.pid)
+        for i in range(10):
+            self.assertTrue(watcher.is_running())
+        self.assertEqual(scan.scans, 1)
+
+        self.process.kill()
+        self.process.wait()
+        self.assertFalse(watcher.is_running())
+        self.assertEqual(scan.scans, 2)
+
+    def test_pidfile(self):
+        if not os.path.isdir('/proc'):
+            return
+
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write('%i\n' % self.process.pid)
+
+            scan = ProcessScan(maxage=0)
+            watcher = ProcessWatcher((self.marker, ), path,
+                                     scan=scan, interval=0)
+            self.assertEqual(watcher.get_pid(), self.process.pid)
+            self.assertEqual(scan.scans, 0)
+
+            # a stale pidfile naming another process isn't trusted
+            other = ProcessWatcher(('minecraft_server', ), path, interval=0)
+            self.assertFalse(other.is_running())
+
+            self.process.kill()
+            self.process.wait()
+            self.assertFalse(watcher.is_running())
+        finally:
+            os.remove(path)
+
+class Watcher(object):
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.starttime = get_starttime(pid)
+
+class TestResourceSampler(unittest.TestCase):
+
+    def test_samples(self):
+        if not os.path.isdir('/proc'):
+            return
+
+        watcher = Watcher(os.getpid())
+        sampler = ResourceSampler(watcher, size=2)
+
+        for i in range(3):
+            self.assertTrue(sampler.sample())
+
+        # the oldest sample was overwritten
+        samples = sampler.get_samples()
+        self.assertEqual(len(samples), 2)
+        self.assertTrue(samples[0][0] <= samples[1][0])
+
+        resources = sampler.get_aggregates()
+        self.assertTrue(resources['threads'] >= 1)
+        self.assertTrue(resources['rss'] > 0)
+        self.assertTrue(resources['rss_max'] >= resources['rss'])
+        self.assertTrue(resources['cpu'] >= 0)
+
+        watcher.pid = None
+        self.assertFalse(sampler.sample())
+        self.assertEqual(sampler.get_aggregates(), None)
+
+        # a reused pid isn't sampled
+        watcher.pid = os.getpid()
+        watcher.starttime -= 1
+        self.assertFalse(sampler.sample())
+
+    def test_no_scan(self):
+        if not os.path.isdir('/proc'):
+            return
+
+        # the sampler doesn't search the process while it isn't running
+        scan = ProcessScan(maxage=0)
+        watcher = ProcessWatcher(('no-such-server', ), scan=scan, interval=0)
+        sampler = ResourceSampler(watcher)
+
+        for i in range(5):
+            self.assertFalse(sampler.sample())
+        self.assertEqual(scan.scans, 0)
+
+if __name__=="__main__":
+    unittest.main()
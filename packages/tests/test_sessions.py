@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from __future__ import with_statement
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+
+sys.path.append("./../")
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from craftinfo.db.tables import Session, create_tables
+from craftinfo.db.sessions import SessionRecorder
+
+def date(minute):
+    return datetime(2010, 11, 30, 20, minute)
+
+class TestSessionRecorder(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        create_tables(engine)
+        self.session = sessionmaker(bind=engine)()
+
+    def get_sessions(self):
+        query = self.session.query(Session).order_by(Session.uid)
+        return [(s.player, s.login, s.logout, s.interrupted) for s in query]
+
+    def test_batches(self):
+        recorder = SessionRecorder(self.session, batchsize=3, delay=60)
+
+        recorder.on_playerlogin('notch', date(1))
+        recorder.on_playerlogin('jeb', date(2))
+        self.assertEqual(self.get_sessions(), [])
+
+        recorder.on_playerlogout('notch', date(3))
+        self.assertEqual(self.get_sessions(), [
+            ('notch', date(1), date(3), False),
+            ('jeb', date(2), None, False),
+        ])
+
+        recorder.on_serverstart('1.0', date(4))
+        recorder.flush()
+        self.assertEqual(self.get_sessions(), [
+            ('notch', date(1), date(3), False),
+            ('jeb', date(2), date(4), True),
+        ])
+        self.assertEqual(recorder.get_open(), [])
+
+    def test_paused(self):
+        recorder = SessionRecorder(self.session, batchsize=1, delay=0)
+        recorder.paused = True
+
+        # only queued while another recorder writes the history
+        recorder.on_playerlogin('notch', date(1))
+        recorder.flush_if_due()
+        self.assertEqual(self.get_sessions(), [])
+
+        recorder.paused = False
+        recorder.flush_if_due()
+        self.assertEqual(self.get_sessions(), [
+            ('notch', date(1), None, False),
+        ])
+
+    def test_reread(self):
+        recorder = SessionRecorder(self.session, batchsize=1)
+        recorder.on_playerlogin('notch', date(1))
+        recorder.on_playerlogin('jeb', date(2))
+
+        # the same events are ignored if the log is read again
+        recorder = SessionRecorder(self.session, batchsize=1)
+        self.assertEqual(sorted(recorder.get_open()), ['jeb', 'notch'])
+
+        recorder.on_playerlogin('notch', date(1))
+        recorder.on_playerlogin('jeb', date(2))
+        recorder.on_playerlogout('jeb', date(3))
+
+        self.assertEqual(self.get_sessions(), [
+            ('notch', date(1), None, False),
+            ('jeb', date(2), date(3), False),
+        ])
+class TestLockedDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'db.sqlite')
+
+        # fail at once instead of waiting for the lock
+        engine = create_engine(
+            'sqlite:///' + self.path, connect_args={'timeout': 0}
+        )
+        create_tables(engine)
+        self.session = sessionmaker(bind=engine)()
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.directory)
+
+    def lock(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('BEGIN EXCLUSIVE')
+        return connection
+
+    def test_failed_flush(self):
+        recorder = SessionRecorder(self.session, delay=60)
+        recorder.on_playerlogin('notch', date(1))
+
+        lock = self.lock()
+        self.assertRaises(OperationalError, recorder.flush)
+        lock.rollback()
+
+        # the login is kept and written with the logout
+        recorder.on_playerlogout('notch', date(2))
+        recorder.flush()
+
+        query = self.session.query(Session)
+        self.assertEqual(
+            [(s.player, s.login, s.logout) for s in query],
+            [('notch', date(1), date(2))]
+        )
+        self.assertEqual(recorder.get_open(), [])
+
+    def test_failed_batch(self):
+        recorder = SessionRecorder(self.session, batchsize=2, delay=60)
+        recorder.on_playerlogin('notch', date(1))
+
+        # events written by the batchsize don't raise into the parser
+        lock = self.lock()
+        recorder.on_playerlogin('jeb', date(2))
+        recorder.on_playerlogout('notch', date(3))
+        lock.rollback()
+
+        recorder.flush()
+        self.assertEqual(self.session.query(Session).count(), 2)
+        self.assertEqual(recorder.get_open(), ['jeb'])
+
+if __name__=="__main__":
+    unittest.main()
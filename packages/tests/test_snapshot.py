@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import unittest
+from datetime import datetime
+
+sys.path.append("./../")
+
+from craftinfoserver.snapshot import Snapshot, SnapshotBuilder, diff_snapshots
+from craftinfoserver.snapshot import render_binary, render_json, render_xml
+from craftinfoserver.snapshot import parse_binary
+from craftinfoserver.echoclient import parse_xml
+
+SNAPSHOT = Snapshot(
+    True, ['notch', 'jeb'], [u'30.11.2010 - 20:00, Neue Welt \xfcberall'],
+    'survival'
+)
+
+class TestSnapshot(unittest.TestCase):
+
+    def test_renderings(self):
+        info = SNAPSHOT.to_dict()
+
+        self.assertEqual(parse_binary(render_binary(SNAPSHOT)), info)
+        self.assertEqual(json.loads(render_json(SNAPSHOT)), info)
+
+        del info['server']
+        self.assertEqual(parse_xml(render_xml(SNAPSHOT)), info)
+
+    def test_resources(self):
+        resources = dict(cpu=12.5, rss=512 * 1024 ** 2, rss_max=600 * 1024 ** 2,
+                         threads=42)
+        snapshot = Snapshot(True, ['notch'], [], resources=resources)
+        info = snapshot.to_dict()
+
+        self.assertEqual(parse_binary(render_binary(snapshot)), info)
+        self.assertEqual(json.loads(render_json(snapshot)), info)
+        self.assertEqual(parse_xml(render_xml(snapshot)), info)
+
+    def test_incomplete_binary(self):
+        data = render_binary(SNAPSHOT)
+        self.assertRaises(ValueError, parse_binary, data[:-1])
+        self.assertRaises(ValueError, parse_binary, '<info />')
+
+    def test_diff(self):
+        new = Snapshot(False, ['jeb', 'dinnerbone'], [], 'survival')
+
+        self.assertEqual(diff_snapshots(SNAPSHOT, new), [
+            dict(type='online', value=False),
+            dict(type='join', value='dinnerbone'),
+            dict(type='leave', value='notch'),
+            dict(type='remove', value=SNAPSHOT.updates[0]),
+        ])
+        self.assertEqual(diff_snapshots(new, new), [])
+
+class FakeLog(object):
+
+    def __init__(self):
+        self.players = ['notch']
+        self.players_version = 1
+
+    def update(self):
+        pass
+
+    def get_playerlist(self):
+        return list(self.players)
+
+class Message(object):
+
+    def __init__(self, text):
+        self.date = datetime(2010, 11, 30, 20, 0)
+        self.text = text
+
+class TestSnapshotBuilder(unittest.TestCase):
+
+    def test_reuse(self):
+        log = FakeLog()
+        state = dict(version=1, queries=0)
+
+        def get_messages():
+            state['queries'] += 1
+            return [Message('hello')]
+
+        builder = SnapshotBuilder(
+            lambda: True, log, get_messages, lambda: state['version'], 'a'
+        )
+
+        first = builder.build()
+        xml = render_xml(first)
+        self.assertEqual(first.updates, ['30.11.2010 - 20:00, hello'])
+
+        # nothing changed, nothing is queried or rendered again
+        second = builder.build()
+        self.assertEqual(state['queries'], 1)
+        self.assertTrue(
+            second._fragments[('players', 'XML')] is
+            first._fragments[('players', 'XML')]
+        )
+        self.assertEqual(render_xml(second), xml)
+
+        # only the changed section is rendered again
+        log.players.append('jeb')
+        log.players_version += 1
+        third = builder.build()
+        self.assertEqual(state['queries'], 1)
+        self.assertTrue(('updates', 'XML') in third._fragments)
+        self.assertFalse(('players', 'XML') in third._fragments)
+        self.assertEqual(parse_xml(render_xml(third))['players'], ['notch', 'jeb'])
+
+        state['version'] += 1
+        builder.build()
+        self.assertEqual(state['queries'], 2)
+
+if __name__=="__main__":
+    unittest.main()
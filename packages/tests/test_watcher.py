@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from __future__ import with_statement
+
+import os
+import sys
+import unittest
+import gevent
+
+sys.path.append("./../")
+
+from craftinfoserver import LogWatcher
+
+LOGFILE = "watched.log"
+
+def appendlog():
+    with open(LOGFILE, "a") as f:
+        f.write("2010-11-30 20:00:39 [INFO] Saving chunks\n")
+
+class TestLogWatcher(unittest.TestCase):
+
+    def setUp(self):
+        with open(LOGFILE, "w") as f:
+            f.write("")
+
+    def tearDown(self):
+        os.remove(LOGFILE)
+
+    def check_watcher(self, watcher):
+        self.assertFalse(watcher.wait(0.1))
+
+        wait = gevent.spawn(watcher.wait, 5)
+        gevent.sleep(0.1)
+        appendlog()
+
+        self.assertTrue(wait.get())
+        watcher.close()
+
+    def test_inotify(self):
+        watcher = LogWatcher(LOGFILE)
+        if not watcher.uses_inotify:
+            return
+
+        self.check_watcher(watcher)
+
+    def test_polling(self):
+        watcher = LogWatcher(LOGFILE, interval=0.05, use_inotify=False)
+        self.assertFalse(watcher.uses_inotify)
+        self.check_watcher(watcher)
+
+if __name__=="__main__":
+    unittest.main()